@@ -1,16 +1,40 @@
-from typing import Annotated
-from fastapi import Depends
+from typing import Annotated, Optional
+from functools import lru_cache
+from fastapi import Depends, Request
 from google.cloud import bigquery
+import anthropic
 
 from app.config import Settings, get_settings
 from app.services.bigquery import BigQueryService
+from app.services.dwell_time import DwellTimeService
+from app.services.zone_counter import ZoneCounterService
 
 
-def get_bigquery_service(
-    settings: Annotated[Settings, Depends(get_settings)]
-) -> BigQueryService:
-    return BigQueryService(settings)
+@lru_cache()
+def get_bigquery_service() -> BigQueryService:
+    # One client (and HTTP connection pool) shared by every request
+    return BigQueryService(get_settings())
 
 
 BigQueryServiceDep = Annotated[BigQueryService, Depends(get_bigquery_service)]
 SettingsDep = Annotated[Settings, Depends(get_settings)]
+
+
+def get_dwell_time_service(bq_service: BigQueryServiceDep, settings: SettingsDep) -> DwellTimeService:
+    return DwellTimeService(bq_service, settings)
+
+
+def get_zone_counter_service(bq_service: BigQueryServiceDep, settings: SettingsDep) -> ZoneCounterService:
+    return ZoneCounterService(bq_service, settings)
+
+
+DwellTimeServiceDep = Annotated[DwellTimeService, Depends(get_dwell_time_service)]
+ZoneCounterServiceDep = Annotated[ZoneCounterService, Depends(get_zone_counter_service)]
+
+
+def get_anthropic(request: Request) -> Optional[anthropic.AsyncAnthropic]:
+    # Created in the app lifespan; None when no API key is configured
+    return request.app.state.anthropic
+
+
+AnthropicDep = Annotated[Optional[anthropic.AsyncAnthropic], Depends(get_anthropic)]
@@ -0,0 +1,28 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.types import Scope
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson (NumPy arrays are serialized natively)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """Static files that browsers may cache indefinitely.
+
+    Uploaded floor plans get a new timestamped filename on every upload and are never
+    rewritten in place, so a URL always refers to the same bytes. Starlette already
+    answers conditional (ETag / Last-Modified) and range requests.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 206, 304):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
@@ -1,34 +1,61 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, Query, Response
 from datetime import date
-from typing import Optional
+from typing import Literal, Optional
+import numpy as np
 
-from app.api.deps import BigQueryServiceDep, SettingsDep
-from app.services.dwell_time import DwellTimeService
-from app.models.schemas import DwellTimeRequest, DwellTimeResponse
+from app.api.deps import DwellTimeServiceDep
+from app.api.responses import ORJSONResponse
+from app.models.schemas import DwellTimeRequest
+from app.utils.cache import response_cache, response_ttl
 
 router = APIRouter()
 
 
+# Cell fields, in response order, for layout="columns"
+DWELL_CELL_FIELDS = ("x", "y", "total_dwell_seconds", "avg_dwell_seconds", "visit_count", "unique_visitors", "intensity")
+
+
+def cells_payload(cells: dict[str, np.ndarray], layout: str = "rows") -> list[dict] | dict[str, np.ndarray]:
+    """Return the cell arrays as rows, or with layout="columns" as one array per field."""
+    if layout == "columns":
+        return {field: cells[field] for field in DWELL_CELL_FIELDS}
+    return [
+        dict(zip(DWELL_CELL_FIELDS, values))
+        for values in zip(*(cells[field].tolist() for field in DWELL_CELL_FIELDS))
+    ]
+
+
+def add_intensity(cells: dict[str, np.ndarray]) -> None:
+    """Set each cell's intensity to its total dwell relative to the busiest cell."""
+    totals = cells["total_dwell_seconds"].astype(np.float64)
+    max_dwell = totals.max() if len(totals) else 0
+    cells["intensity"] = totals / max_dwell if max_dwell > 0 else np.zeros_like(totals)
+
+
 @router.get("/{store_id}")
 async def get_dwell_heatmap(
     store_id: int,
-    bq_service: BigQueryServiceDep,
-    settings: SettingsDep,
+    dwell_service: DwellTimeServiceDep,
     floor: int = Query(0, description="Floor number"),
     start_date: date = Query(..., description="Start date (YYYY-MM-DD)"),
     end_date: date = Query(..., description="End date (YYYY-MM-DD)"),
     start_hour: int = Query(0, ge=0, le=23, description="Start hour (0-23)"),
     end_hour: int = Query(23, ge=0, le=23, description="End hour (0-23)"),
-    min_dwell_seconds: int = Query(30, description="Minimum dwell time in seconds"),
+    min_dwell_seconds: int = Query(30, ge=0, description="Minimum dwell time in seconds"),
     max_dwell_seconds: Optional[int] = Query(None, description="Maximum dwell time in seconds"),
-    grid_size: Optional[float] = Query(None, description="Grid cell size in meters")
+    grid_size: Optional[float] = Query(None, gt=0, description="Grid cell size in meters"),
+    layout: Literal["rows", "columns"] = Query("rows", description="'rows' for a list of cells, 'columns' for {x: [...], y: [...], ...}")
 ):
     """
     Get dwell time heatmap for a store.
 
     Calculates time spent at each location and aggregates into grid cells.
     """
-    dwell_service = DwellTimeService(bq_service, settings)
+    cache_key = ("dwell", store_id, floor, start_date, end_date, start_hour, end_hour,
+                 min_dwell_seconds, max_dwell_seconds, grid_size, layout)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
 
     data = await dwell_service.get_dwell_heatmap(
         store_id=store_id,
@@ -43,25 +70,31 @@ async def get_dwell_heatmap(
     )
 
     # Add normalized intensity for visualization
-    if data["cells"]:
-        max_dwell = max(c["total_dwell_seconds"] for c in data["cells"])
-        for cell in data["cells"]:
-            cell["intensity"] = cell["total_dwell_seconds"] / max_dwell if max_dwell > 0 else 0
+    add_intensity(data["cells"])
+    data["cells"] = cells_payload(data["cells"], layout)
 
-    return data
+    # Returned ready-made so FastAPI does not run jsonable_encoder over every cell;
+    # only the encoded body is cached
+    json_response = ORJSONResponse(data)
+    response_cache.set(cache_key, json_response.body, ttl=response_ttl(end_date))
+    return json_response
 
 
 @router.post("/{store_id}")
 async def get_dwell_heatmap_post(
     store_id: int,
     request: DwellTimeRequest,
-    bq_service: BigQueryServiceDep,
-    settings: SettingsDep
+    dwell_service: DwellTimeServiceDep
 ):
     """
     Get dwell time heatmap for a store (POST version).
     """
-    dwell_service = DwellTimeService(bq_service, settings)
+    cache_key = ("dwell_post", store_id, request.floor, request.start_date, request.end_date,
+                 request.start_hour, request.end_hour, request.min_dwell_seconds,
+                 request.max_dwell_seconds, request.grid_size, request.layout)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
 
     data = await dwell_service.get_dwell_heatmap(
         store_id=store_id,
@@ -76,9 +109,9 @@ async def get_dwell_heatmap_post(
     )
 
     # Add normalized intensity
-    if data["cells"]:
-        max_dwell = max(c["total_dwell_seconds"] for c in data["cells"])
-        for cell in data["cells"]:
-            cell["intensity"] = cell["total_dwell_seconds"] / max_dwell if max_dwell > 0 else 0
+    add_intensity(data["cells"])
+    data["cells"] = cells_payload(data["cells"], request.layout)
 
-    return data
+    json_response = ORJSONResponse(data)
+    response_cache.set(cache_key, json_response.body, ttl=response_ttl(request.end_date))
+    return json_response
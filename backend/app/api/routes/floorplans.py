@@ -1,103 +1,109 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from pydantic import TypeAdapter
 from PIL import Image
 import aiofiles
-import aiosqlite
+import asyncio
+import hashlib
 import os
+import struct
 from datetime import datetime
 
 from app.api.deps import SettingsDep
-from app.models.database import get_db, FloorPlanModel
-from app.models.schemas import FloorPlan, FloorPlanCreate, FloorPlanCalibration, FloorPlanAdjustment
+from app.models.database import get_db, offset_cache, FloorPlanModel
+from app.models.schemas import FloorPlan, FloorPlanCalibration, FloorPlanAdjustment
+from app.utils.cache import TTLCache, response_cache
 
 router = APIRouter()
 
-# Path to SQLite database for direct queries
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "tracking.db")
+# Serialized floor plan list and its ETag per store. Floor plans only change through
+# this router, so every write below invalidates its store's entry.
+floorplan_list_cache = TTLCache(ttl=300, maxsize=256)
+_floorplan_list_adapter = TypeAdapter(list[FloorPlan])
 
+UPLOAD_CHUNK_SIZE = 1 << 20
 
-async def get_adjustments(store_id: int, floor: int) -> dict:
-    """Get floor plan adjustments from database."""
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                """SELECT adjust_offset_x, adjust_offset_y, adjust_scale, adjust_rotation,
-                          affine_a, affine_b, affine_c, affine_d, affine_tx, affine_ty,
-                          adjust_scale_x, adjust_scale_y
-                   FROM floorplans WHERE store_id = ? AND floor = ?""",
-                (store_id, floor)
-            )
-            row = await cursor.fetchone()
-            if row:
-                return {
-                    'adjust_offset_x': row[0] or 0.0,
-                    'adjust_offset_y': row[1] or 0.0,
-                    'adjust_scale': row[2] or 1.0,
-                    'adjust_rotation': row[3] or 0.0,
-                    'affine_a': row[4],
-                    'affine_b': row[5],
-                    'affine_c': row[6],
-                    'affine_d': row[7],
-                    'affine_tx': row[8],
-                    'affine_ty': row[9],
-                    'adjust_scale_x': row[10] or 1.0,
-                    'adjust_scale_y': row[11] or 1.0,
-                }
-    except Exception:
-        pass
-    return {
-        'adjust_offset_x': 0.0, 'adjust_offset_y': 0.0, 'adjust_scale': 1.0, 'adjust_rotation': 0.0,
-        'adjust_scale_x': 1.0, 'adjust_scale_y': 1.0,
-        'affine_a': None, 'affine_b': None, 'affine_c': None, 'affine_d': None, 'affine_tx': None, 'affine_ty': None
-    }
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+
+
+def _is_image(header: bytes) -> bool:
+    """Check the leading bytes for a PNG, JPEG, GIF or WebP signature."""
+    return (
+        header.startswith((PNG_SIGNATURE, JPEG_SIGNATURE, b"GIF87a", b"GIF89a"))
+        or (header[:4] == b"RIFF" and header[8:12] == b"WEBP")
+    )
+
+
+def _image_size(filepath: str) -> tuple[int, int]:
+    """Read image dimensions, parsing only the IHDR chunk for PNGs."""
+    with open(filepath, "rb") as f:
+        header = f.read(24)
+    if header[:8] == PNG_SIGNATURE and header[12:16] == b"IHDR":
+        return struct.unpack(">II", header[16:24])
+    with Image.open(filepath) as img:
+        return img.size
+
+
+def _to_floorplan(fp: FloorPlanModel) -> FloorPlan:
+    """Build the API schema from an ORM row (adjustment columns may be NULL on older rows).
+
+    The row is already typed by the ORM, so the model is constructed without validation.
+    """
+    return FloorPlan.model_construct(
+        id=fp.id,
+        store_id=fp.store_id,
+        floor=fp.floor,
+        filename=fp.filename,
+        url=f"/uploads/floorplans/{fp.filename}",
+        data_min_x=fp.data_min_x,
+        data_max_x=fp.data_max_x,
+        data_min_y=fp.data_min_y,
+        data_max_y=fp.data_max_y,
+        image_width=fp.image_width,
+        image_height=fp.image_height,
+        adjust_offset_x=fp.adjust_offset_x or 0.0,
+        adjust_offset_y=fp.adjust_offset_y or 0.0,
+        adjust_scale=fp.adjust_scale or 1.0,
+        adjust_scale_x=fp.adjust_scale_x or 1.0,
+        adjust_scale_y=fp.adjust_scale_y or 1.0,
+        adjust_rotation=fp.adjust_rotation or 0.0,
+        affine_a=fp.affine_a,
+        affine_b=fp.affine_b,
+        affine_c=fp.affine_c,
+        affine_d=fp.affine_d,
+        affine_tx=fp.affine_tx,
+        affine_ty=fp.affine_ty,
+        created_at=fp.created_at
+    )
 
 
 @router.get("/store/{store_id}", response_model=list[FloorPlan])
 async def list_floorplans(
     store_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
     settings: SettingsDep = None
 ):
     """List all floor plans for a store"""
-    result = await db.execute(
-        select(FloorPlanModel).where(FloorPlanModel.store_id == store_id)
-    )
-    floorplans = result.scalars().all()
-
-    floor_plans_with_adjustments = []
-    for fp in floorplans:
-        # Get adjustments from direct DB query (columns may not be in ORM model yet)
-        adjustments = await get_adjustments(fp.store_id, fp.floor)
-        floor_plans_with_adjustments.append(
-            FloorPlan(
-                id=fp.id,
-                store_id=fp.store_id,
-                floor=fp.floor,
-                filename=fp.filename,
-                url=f"/uploads/floorplans/{fp.filename}",
-                data_min_x=fp.data_min_x,
-                data_max_x=fp.data_max_x,
-                data_min_y=fp.data_min_y,
-                data_max_y=fp.data_max_y,
-                image_width=fp.image_width,
-                image_height=fp.image_height,
-                adjust_offset_x=adjustments['adjust_offset_x'],
-                adjust_offset_y=adjustments['adjust_offset_y'],
-                adjust_scale=adjustments['adjust_scale'],
-                adjust_scale_x=adjustments['adjust_scale_x'],
-                adjust_scale_y=adjustments['adjust_scale_y'],
-                adjust_rotation=adjustments['adjust_rotation'],
-                affine_a=adjustments['affine_a'],
-                affine_b=adjustments['affine_b'],
-                affine_c=adjustments['affine_c'],
-                affine_d=adjustments['affine_d'],
-                affine_tx=adjustments['affine_tx'],
-                affine_ty=adjustments['affine_ty'],
-                created_at=fp.created_at
-            )
+    cached = floorplan_list_cache.get(store_id)
+    if cached is None:
+        result = await db.execute(
+            select(FloorPlanModel).where(FloorPlanModel.store_id == store_id)
         )
-    return floor_plans_with_adjustments
+        floorplans = result.scalars().all()
+
+        body = _floorplan_list_adapter.dump_json([_to_floorplan(fp) for fp in floorplans])
+        cached = (body, f'"{hashlib.md5(body).hexdigest()}"')
+        floorplan_list_cache.set(store_id, cached)
+
+    body, etag = cached
+    # Revalidate every time (a cheap 304): the list must reflect uploads immediately
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/{floorplan_id}", response_model=FloorPlan)
@@ -106,41 +112,12 @@ async def get_floorplan(
     db: AsyncSession = Depends(get_db)
 ):
     """Get a specific floor plan"""
-    result = await db.execute(
-        select(FloorPlanModel).where(FloorPlanModel.id == floorplan_id)
-    )
-    fp = result.scalar_one_or_none()
+    fp = await db.get(FloorPlanModel, floorplan_id)
 
     if not fp:
         raise HTTPException(status_code=404, detail="Floor plan not found")
 
-    adjustments = await get_adjustments(fp.store_id, fp.floor)
-    return FloorPlan(
-        id=fp.id,
-        store_id=fp.store_id,
-        floor=fp.floor,
-        filename=fp.filename,
-        url=f"/uploads/floorplans/{fp.filename}",
-        data_min_x=fp.data_min_x,
-        data_max_x=fp.data_max_x,
-        data_min_y=fp.data_min_y,
-        data_max_y=fp.data_max_y,
-        image_width=fp.image_width,
-        image_height=fp.image_height,
-        adjust_offset_x=adjustments['adjust_offset_x'],
-        adjust_offset_y=adjustments['adjust_offset_y'],
-        adjust_scale=adjustments['adjust_scale'],
-        adjust_scale_x=adjustments['adjust_scale_x'],
-        adjust_scale_y=adjustments['adjust_scale_y'],
-        adjust_rotation=adjustments['adjust_rotation'],
-        affine_a=adjustments['affine_a'],
-        affine_b=adjustments['affine_b'],
-        affine_c=adjustments['affine_c'],
-        affine_d=adjustments['affine_d'],
-        affine_tx=adjustments['affine_tx'],
-        affine_ty=adjustments['affine_ty'],
-        created_at=fp.created_at
-    )
+    return _to_floorplan(fp)
 
 
 @router.post("/upload", response_model=FloorPlan)
@@ -159,20 +136,38 @@ async def upload_floorplan(
     # Validate file type
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
+    if file.size is not None and file.size > settings.max_upload_bytes:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    # The content type is client-controlled, so also check the file signature
+    header = await file.read(16)
+    if not _is_image(header):
+        raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Generate filename
+    # Generate filename (unique per upload, so served images can be cached as immutable)
     ext = file.filename.split(".")[-1] if file.filename else "png"
-    filename = f"store_{store_id}_floor_{floor}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+    filename = f"store_{store_id}_floor_{floor}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.{ext}"
     filepath = os.path.join(settings.floorplans_dir, filename)
 
-    # Save file
+    # Save file in chunks so large plans are never held in memory
+    size = len(header)
     async with aiofiles.open(filepath, "wb") as f:
-        content = await file.read()
-        await f.write(content)
+        await f.write(header)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > settings.max_upload_bytes:
+                break
+            await f.write(chunk)
+    if size > settings.max_upload_bytes:
+        os.remove(filepath)
+        raise HTTPException(status_code=413, detail="File too large")
 
-    # Get image dimensions
-    with Image.open(filepath) as img:
-        image_width, image_height = img.size
+    # Get image dimensions; a file with an image signature may still not decode
+    try:
+        image_width, image_height = await asyncio.to_thread(_image_size, filepath)
+    except Exception:
+        os.remove(filepath)
+        raise HTTPException(status_code=400, detail="File must be an image")
 
     # Check if floor plan already exists for this store/floor
     result = await db.execute(
@@ -215,21 +210,12 @@ async def upload_floorplan(
 
     await db.commit()
     await db.refresh(fp)
+    # Heatmap/dwell responses are aligned with this floor plan
+    response_cache.clear()
+    floorplan_list_cache.invalidate(fp.store_id)
+    offset_cache.invalidate((fp.store_id, fp.floor))
 
-    return FloorPlan(
-        id=fp.id,
-        store_id=fp.store_id,
-        floor=fp.floor,
-        filename=fp.filename,
-        url=f"/uploads/floorplans/{fp.filename}",
-        data_min_x=fp.data_min_x,
-        data_max_x=fp.data_max_x,
-        data_min_y=fp.data_min_y,
-        data_max_y=fp.data_max_y,
-        image_width=fp.image_width,
-        image_height=fp.image_height,
-        created_at=fp.created_at
-    )
+    return _to_floorplan(fp)
 
 
 @router.put("/{floorplan_id}/calibrate", response_model=FloorPlan)
@@ -239,10 +225,7 @@ async def calibrate_floorplan(
     db: AsyncSession = Depends(get_db)
 ):
     """Update floor plan calibration (coordinate mapping)"""
-    result = await db.execute(
-        select(FloorPlanModel).where(FloorPlanModel.id == floorplan_id)
-    )
-    fp = result.scalar_one_or_none()
+    fp = await db.get(FloorPlanModel, floorplan_id)
 
     if not fp:
         raise HTTPException(status_code=404, detail="Floor plan not found")
@@ -254,34 +237,12 @@ async def calibrate_floorplan(
 
     await db.commit()
     await db.refresh(fp)
+    # Heatmap/dwell responses are aligned with this floor plan
+    response_cache.clear()
+    floorplan_list_cache.invalidate(fp.store_id)
+    offset_cache.invalidate((fp.store_id, fp.floor))
 
-    adjustments = await get_adjustments(fp.store_id, fp.floor)
-    return FloorPlan(
-        id=fp.id,
-        store_id=fp.store_id,
-        floor=fp.floor,
-        filename=fp.filename,
-        url=f"/uploads/floorplans/{fp.filename}",
-        data_min_x=fp.data_min_x,
-        data_max_x=fp.data_max_x,
-        data_min_y=fp.data_min_y,
-        data_max_y=fp.data_max_y,
-        image_width=fp.image_width,
-        image_height=fp.image_height,
-        adjust_offset_x=adjustments['adjust_offset_x'],
-        adjust_offset_y=adjustments['adjust_offset_y'],
-        adjust_scale=adjustments['adjust_scale'],
-        adjust_scale_x=adjustments['adjust_scale_x'],
-        adjust_scale_y=adjustments['adjust_scale_y'],
-        adjust_rotation=adjustments['adjust_rotation'],
-        affine_a=adjustments['affine_a'],
-        affine_b=adjustments['affine_b'],
-        affine_c=adjustments['affine_c'],
-        affine_d=adjustments['affine_d'],
-        affine_tx=adjustments['affine_tx'],
-        affine_ty=adjustments['affine_ty'],
-        created_at=fp.created_at
-    )
+    return _to_floorplan(fp)
 
 
 @router.put("/{floorplan_id}/adjust", response_model=FloorPlan)
@@ -291,57 +252,30 @@ async def adjust_floorplan(
     db: AsyncSession = Depends(get_db)
 ):
     """Update floor plan visual adjustment (offset, scale, rotation, and affine transform)"""
-    result = await db.execute(
-        select(FloorPlanModel).where(FloorPlanModel.id == floorplan_id)
-    )
-    fp = result.scalar_one_or_none()
+    fp = await db.get(FloorPlanModel, floorplan_id)
 
     if not fp:
         raise HTTPException(status_code=404, detail="Floor plan not found")
 
-    # Update adjustments directly in database (columns may not be in ORM model yet)
-    async with aiosqlite.connect(DB_PATH) as sdb:
-        await sdb.execute(
-            """UPDATE floorplans
-               SET adjust_offset_x = ?, adjust_offset_y = ?, adjust_scale = ?, adjust_rotation = ?,
-                   adjust_scale_x = ?, adjust_scale_y = ?,
-                   affine_a = ?, affine_b = ?, affine_c = ?, affine_d = ?, affine_tx = ?, affine_ty = ?
-               WHERE id = ?""",
-            (adjustment.adjust_offset_x, adjustment.adjust_offset_y,
-             adjustment.adjust_scale, adjustment.adjust_rotation,
-             adjustment.adjust_scale_x, adjustment.adjust_scale_y,
-             adjustment.affine_a, adjustment.affine_b, adjustment.affine_c,
-             adjustment.affine_d, adjustment.affine_tx, adjustment.affine_ty,
-             floorplan_id)
-        )
-        await sdb.commit()
+    fp.adjust_offset_x = adjustment.adjust_offset_x
+    fp.adjust_offset_y = adjustment.adjust_offset_y
+    fp.adjust_scale = adjustment.adjust_scale
+    fp.adjust_scale_x = adjustment.adjust_scale_x
+    fp.adjust_scale_y = adjustment.adjust_scale_y
+    fp.adjust_rotation = adjustment.adjust_rotation
+    fp.affine_a = adjustment.affine_a
+    fp.affine_b = adjustment.affine_b
+    fp.affine_c = adjustment.affine_c
+    fp.affine_d = adjustment.affine_d
+    fp.affine_tx = adjustment.affine_tx
+    fp.affine_ty = adjustment.affine_ty
 
-    return FloorPlan(
-        id=fp.id,
-        store_id=fp.store_id,
-        floor=fp.floor,
-        filename=fp.filename,
-        url=f"/uploads/floorplans/{fp.filename}",
-        data_min_x=fp.data_min_x,
-        data_max_x=fp.data_max_x,
-        data_min_y=fp.data_min_y,
-        data_max_y=fp.data_max_y,
-        image_width=fp.image_width,
-        image_height=fp.image_height,
-        adjust_offset_x=adjustment.adjust_offset_x,
-        adjust_offset_y=adjustment.adjust_offset_y,
-        adjust_scale=adjustment.adjust_scale,
-        adjust_scale_x=adjustment.adjust_scale_x,
-        adjust_scale_y=adjustment.adjust_scale_y,
-        adjust_rotation=adjustment.adjust_rotation,
-        affine_a=adjustment.affine_a,
-        affine_b=adjustment.affine_b,
-        affine_c=adjustment.affine_c,
-        affine_d=adjustment.affine_d,
-        affine_tx=adjustment.affine_tx,
-        affine_ty=adjustment.affine_ty,
-        created_at=fp.created_at
-    )
+    await db.commit()
+    response_cache.clear()
+    floorplan_list_cache.invalidate(fp.store_id)
+    offset_cache.invalidate((fp.store_id, fp.floor))
+
+    return _to_floorplan(fp)
 
 
 @router.delete("/{floorplan_id}")
@@ -351,10 +285,7 @@ async def delete_floorplan(
     settings: SettingsDep = None
 ):
     """Delete a floor plan"""
-    result = await db.execute(
-        select(FloorPlanModel).where(FloorPlanModel.id == floorplan_id)
-    )
-    fp = result.scalar_one_or_none()
+    fp = await db.get(FloorPlanModel, floorplan_id)
 
     if not fp:
         raise HTTPException(status_code=404, detail="Floor plan not found")
@@ -366,5 +297,8 @@ async def delete_floorplan(
 
     await db.delete(fp)
     await db.commit()
+    response_cache.clear()
+    floorplan_list_cache.invalidate(fp.store_id)
+    offset_cache.invalidate((fp.store_id, fp.floor))
 
     return {"message": "Floor plan deleted", "id": floorplan_id}
@@ -1,31 +1,98 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Response
 from datetime import date
-import aiosqlite
-import os
+from typing import Literal
+import asyncio
+import numpy as np
 
 from app.api.deps import BigQueryServiceDep
-from app.models.schemas import HeatmapRequest, HeatmapResponse
+from app.services.bigquery import BigQueryService
+from app.models.database import get_coordinate_offset
+from app.api.responses import ORJSONResponse
+from app.models.schemas import Bounds, HeatmapRequest
+from app.utils.cache import response_cache, response_ttl
 
 router = APIRouter()
 
-# Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "tracking.db")
 
+def point_bounds(x: np.ndarray, y: np.ndarray) -> Bounds:
+    if len(x):
+        return {
+            "min_x": float(x.min()),
+            "max_x": float(x.max()),
+            "min_y": float(y.min()),
+            "max_y": float(y.max())
+        }
+    return {"min_x": 0, "max_x": 0, "min_y": 0, "max_y": 0}
 
-async def get_coordinate_offset(store_id: int, floor: int) -> tuple[float, float]:
-    """Get coordinate offset for a floor plan (to align tracking data with floor plan)."""
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT offset_x, offset_y FROM floorplans WHERE store_id = ? AND floor = ?",
-                (store_id, floor)
-            )
-            row = await cursor.fetchone()
-            if row and row[0] is not None and row[1] is not None:
-                return row[0], row[1]  # offset_x (longitude), offset_y (latitude)
-    except Exception:
-        pass
-    return 0.0, 0.0
+
+def build_points(points: list[dict], offset_x: float, offset_y: float) -> tuple[list[dict], Bounds]:
+    """Shift points into floor plan space (x = longitude + offset_x, y = latitude + offset_y).
+
+    Sets x/y on each point dict and returns the points with their bounds.
+    """
+    count = len(points)
+    x = np.fromiter((p["longitude"] for p in points), dtype=np.float64, count=count) + offset_x
+    y = np.fromiter((p["latitude"] for p in points), dtype=np.float64, count=count) + offset_y
+
+    for point, px, py in zip(points, x.tolist(), y.tolist()):
+        point["x"] = px
+        point["y"] = py
+    return points, point_bounds(x, y)
+
+
+def build_columns(
+    longitude: np.ndarray,
+    latitude: np.ndarray,
+    offset_x: float,
+    offset_y: float
+) -> tuple[dict, Bounds]:
+    """Column layout of build_points: only the shifted x and y arrays (orjson encodes them natively)."""
+    x = longitude + offset_x
+    y = latitude + offset_y
+    return {"x": x, "y": y}, point_bounds(x, y)
+
+
+async def load_points(
+    bq_service: BigQueryService,
+    store_id: int,
+    floor: int,
+    start_date: date,
+    end_date: date,
+    start_hour: int,
+    end_hour: int,
+    layout: str
+) -> tuple[list[dict] | dict, Bounds, int, int]:
+    """Fetch up to 250k sampled points aligned with the floor plan.
+
+    The columns layout reads only the coordinate columns, straight into arrays.
+
+    Returns:
+        Tuple of (points payload, bounds, total_returned, total_in_database)
+    """
+    query = dict(
+        store_id=store_id,
+        floor=floor,
+        start_date=start_date,
+        end_date=end_date,
+        start_hour=start_hour,
+        end_hour=end_hour,
+        max_points=250000
+    )
+    # Points and the coordinate offset that aligns them with the floor plan are independent
+    if layout == "columns":
+        (arrays, total_count), (offset_x, offset_y) = await asyncio.gather(
+            bq_service.get_raw_track_arrays(**query),
+            get_coordinate_offset(store_id, floor)
+        )
+        payload, bounds = build_columns(arrays["longitude"], arrays["latitude"], offset_x, offset_y)
+        return payload, bounds, len(arrays["longitude"]), total_count
+
+    (points, total_count), (offset_x, offset_y) = await asyncio.gather(
+        bq_service.get_raw_tracks(**query),
+        get_coordinate_offset(store_id, floor)
+    )
+    payload, bounds = build_points(points, offset_x, offset_y)
+    return payload, bounds, len(points), total_count
 
 
 @router.get("/{store_id}")
@@ -36,7 +103,8 @@ async def get_heatmap(
     start_date: date = Query(..., description="Start date (YYYY-MM-DD)"),
     end_date: date = Query(..., description="End date (YYYY-MM-DD)"),
     start_hour: int = Query(0, ge=0, le=23, description="Start hour (0-23)"),
-    end_hour: int = Query(23, ge=0, le=23, description="End hour (0-23)")
+    end_hour: int = Query(23, ge=0, le=23, description="End hour (0-23)"),
+    layout: Literal["rows", "columns"] = Query("rows", description="'rows' for a list of points, 'columns' for {x: [...], y: [...]}")
 ):
     """
     Get raw tracking points for heatmap visualization.
@@ -44,55 +112,38 @@ async def get_heatmap(
     Returns up to 250k sampled points for visualization.
     Zone calculations use ALL data from BigQuery (100% accurate).
     """
-    points, total_count = await bq_service.get_raw_tracks(
-        store_id=store_id,
-        floor=floor,
-        start_date=start_date,
-        end_date=end_date,
-        start_hour=start_hour,
-        end_hour=end_hour,
-        max_points=250000
+    # Responses are returned ready-made: for a plain dict FastAPI would first run
+    # jsonable_encoder over every point before orjson ever sees it. Only the encoded
+    # body is cached, not the point dicts.
+    cache_key = ("heatmap", store_id, floor, start_date, end_date, start_hour, end_hour, layout)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    # Points and floor totals (no zone filtering) are independent, so fetch them concurrently
+    (payload, bounds, total_returned, total_count), floor_totals = await asyncio.gather(
+        load_points(bq_service, store_id, floor, start_date, end_date, start_hour, end_hour, layout),
+        bq_service.get_floor_totals(
+            store_id=store_id,
+            floor=floor,
+            start_date=start_date,
+            end_date=end_date,
+            start_hour=start_hour,
+            end_hour=end_hour
+        )
     )
 
-    # Get total unique visitors for the entire floor (no zone filtering)
-    floor_totals = await bq_service.get_floor_totals(
-        store_id=store_id,
-        floor=floor,
-        start_date=start_date,
-        end_date=end_date,
-        start_hour=start_hour,
-        end_hour=end_hour
-    )
-
-    # Get coordinate offset to align tracking data with floor plan
-    offset_x, offset_y = await get_coordinate_offset(store_id, floor)
-
-    # Apply offset and compute bounds
-    min_x, max_x = float('inf'), float('-inf')
-    min_y, max_y = float('inf'), float('-inf')
-
-    for point in points:
-        # Apply offset: x = longitude, y = latitude
-        point["x"] = point["longitude"] + offset_x
-        point["y"] = point["latitude"] + offset_y
-        min_x = min(min_x, point["x"])
-        max_x = max(max_x, point["x"])
-        min_y = min(min_y, point["y"])
-        max_y = max(max_y, point["y"])
-
-    return {
-        "points": points,
-        "bounds": {
-            "min_x": min_x if points else 0,
-            "max_x": max_x if points else 0,
-            "min_y": min_y if points else 0,
-            "max_y": max_y if points else 0
-        },
-        "total_returned": len(points),
+    response = {
+        "points": payload,
+        "bounds": bounds,
+        "total_returned": total_returned,
         "total_in_database": total_count,
         "total_unique_visitors": floor_totals["unique_visitors"],
         "total_visitor_days": floor_totals["visitor_days"]  # Accumulated visits
     }
+    json_response = ORJSONResponse(response)
+    response_cache.set(cache_key, json_response.body, ttl=response_ttl(end_date))
+    return json_response
 
 
 @router.get("/diagnostic/{store_id}")
@@ -107,19 +158,18 @@ async def get_data_diagnostic(
 
     table_id = bq_service.table_id
 
-    # Check overall data stats
+    # Check overall data stats (shaped in SQL so rows map straight to dicts)
     query = f"""
     SELECT
-        store_id,
         floor,
-        MIN(date) as min_date,
-        MAX(date) as max_date,
+        CONCAT(CAST(MIN(date) AS STRING), ' to ', CAST(MAX(date) AS STRING)) as date_range,
+        COUNT(DISTINCT date) as days_with_data,
         COUNT(*) as total_positions,
         COUNT(DISTINCT hash_id) as unique_visitors,
-        COUNT(DISTINCT date) as days_with_data
+        IFNULL(ROUND(SAFE_DIVIDE(COUNT(*), COUNT(DISTINCT hash_id)), 1), 0) as avg_positions_per_visitor
     FROM `{table_id}`
     WHERE store_id = @store_id
-    GROUP BY store_id, floor
+    GROUP BY floor
     ORDER BY floor
     """
 
@@ -129,44 +179,28 @@ async def get_data_diagnostic(
         ]
     )
 
-    query_job = bq_service.client.query(query, job_config=job_config)
-    results = list(query_job.result())
-
-    floors_data = []
-    for row in results:
-        floors_data.append({
-            "floor": row.floor,
-            "date_range": f"{row.min_date} to {row.max_date}",
-            "days_with_data": row.days_with_data,
-            "total_positions": row.total_positions,
-            "unique_visitors": row.unique_visitors,
-            "avg_positions_per_visitor": round(row.total_positions / row.unique_visitors, 1) if row.unique_visitors > 0 else 0
-        })
-
     # Check daily breakdown for November 2025
     daily_query = f"""
     SELECT
-        date,
+        CAST(date AS STRING) as date,
         COUNT(*) as positions,
         COUNT(DISTINCT hash_id) as visitors
     FROM `{table_id}`
     WHERE store_id = @store_id
         AND floor = 1
         AND date BETWEEN '2025-11-01' AND '2025-11-30'
-    GROUP BY date
-    ORDER BY date
+    GROUP BY 1
+    ORDER BY 1
     """
 
-    daily_job = bq_service.client.query(daily_query, job_config=job_config)
-    daily_results = list(daily_job.result())
+    # Both jobs run in parallel, each submitted and awaited off the event loop
+    floor_rows, daily_rows = await asyncio.gather(
+        bq_service.run_query(query, job_config, label="get_data_diagnostic"),
+        bq_service.run_query(daily_query, job_config, label="get_data_diagnostic")
+    )
 
-    daily_data = []
-    for row in daily_results:
-        daily_data.append({
-            "date": str(row.date),
-            "positions": row.positions,
-            "visitors": row.visitors
-        })
+    floors_data = [dict(row.items()) for row in floor_rows]
+    daily_data = [dict(row.items()) for row in daily_rows]
 
     return {
         "store_id": store_id,
@@ -185,39 +219,23 @@ async def get_heatmap_post(
     """
     Get raw tracking points for heatmap visualization (POST version).
     """
-    points, total_count = await bq_service.get_raw_tracks(
-        store_id=store_id,
-        floor=request.floor,
-        start_date=request.start_date,
-        end_date=request.end_date,
-        start_hour=request.start_hour,
-        end_hour=request.end_hour,
-        max_points=250000
+    cache_key = ("heatmap_post", store_id, request.floor, request.start_date, request.end_date,
+                 request.start_hour, request.end_hour, request.layout)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    payload, bounds, total_returned, total_count = await load_points(
+        bq_service, store_id, request.floor, request.start_date, request.end_date,
+        request.start_hour, request.end_hour, request.layout
     )
 
-    # Get coordinate offset to align tracking data with floor plan
-    offset_x, offset_y = await get_coordinate_offset(store_id, request.floor)
-
-    # Apply offset and compute bounds
-    min_x, max_x = float('inf'), float('-inf')
-    min_y, max_y = float('inf'), float('-inf')
-
-    for point in points:
-        point["x"] = point["longitude"] + offset_x
-        point["y"] = point["latitude"] + offset_y
-        min_x = min(min_x, point["x"])
-        max_x = max(max_x, point["x"])
-        min_y = min(min_y, point["y"])
-        max_y = max(max_y, point["y"])
-
-    return {
-        "points": points,
-        "bounds": {
-            "min_x": min_x if points else 0,
-            "max_x": max_x if points else 0,
-            "min_y": min_y if points else 0,
-            "max_y": max_y if points else 0
-        },
-        "total_returned": len(points),
+    response = {
+        "points": payload,
+        "bounds": bounds,
+        "total_returned": total_returned,
         "total_in_database": total_count
     }
+    json_response = ORJSONResponse(response)
+    response_cache.set(cache_key, json_response.body, ttl=response_ttl(request.end_date))
+    return json_response
@@ -1,128 +1,78 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from datetime import date
+from typing import AsyncIterator, Literal, Optional
 import anthropic
+import asyncio
+import hashlib
+import json
+import logging
+import re
 
-from app.config import get_settings
+from app.api.deps import AnthropicDep
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Identical requests (dashboard reloads) reuse the earlier answer instead of calling Claude again
+insights_cache = TTLCache(ttl=1800, maxsize=1024)
 
-class InsightsRequest(BaseModel):
-    mode: str  # 'tracks' or 'dwell'
-    store_id: int
-    floor: int
-    start_date: str
-    end_date: str
-    start_hour: int
-    end_hour: int
-    # Tracks mode data
-    total_rendered: Optional[int] = None
-    total_in_database: Optional[int] = None
-    # Dwell mode data
-    total_dwell_time: Optional[int] = None
-    avg_dwell_time: Optional[float] = None
-    active_cells: Optional[int] = None
-    # Zone data
-    zones_count: Optional[int] = None
-    # Custom user prompt
-    custom_prompt: Optional[str] = None
-    # Follow-up flag for Q&A style responses
-    is_followup: bool = False
+# Claude calls still running, by cache key, so concurrent duplicates (several tabs
+# loading the same view) share one call. Checked and filled without awaiting in
+# between, so no lock is needed.
+_inflight: dict[str, asyncio.Task] = {}
 
 
-class InsightsResponse(BaseModel):
-    analysis: str
-    alarms: list[str]
-    actions: list[str]
-    answer: Optional[str] = None  # For Q&A follow-up responses
-
-
-@router.post("/generate")
-async def generate_insights(request: InsightsRequest) -> InsightsResponse:
-    """Generate AI insights based on heatmap/dwell data."""
-    settings = get_settings()
+class _SectionBroadcast:
+    """Events of one streaming Claude call, replayed to every stream subscribed to it.
 
-    if not settings.anthropic_api_key:
-        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+    A subscriber gets the events published so far, then each new one; the last
+    event is the full response ("done") or an error.
+    """
 
-    client = anthropic.Anthropic(api_key=settings.anthropic_api_key)
+    def __init__(self):
+        self.events: list[dict] = []
+        self._queues: list[asyncio.Queue] = []
 
-    # Store mapping for context
-    store_names = {
-        445: "IKEA Malmö, Sweden"
-    }
-    store_name = store_names.get(request.store_id, f"IKEA Store {request.store_id}")
+    def publish(self, event: dict) -> None:
+        self.events.append(event)
+        for queue in self._queues:
+            queue.put_nowait(event)
 
-    # Handle follow-up Q&A requests differently
-    if request.is_followup and request.custom_prompt:
-        followup_system = """You are a senior retail intelligence analyst for IKEA stores.
-Provide direct, actionable answers. Be specific and practical.
-Do not use section headers or bullet points - write in clear paragraphs."""
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        self._queues.append(queue)
+        return queue
 
-        followup_prompt = f"""Context:
-- Store: {store_name} (Floor {request.floor})
-- Date range: {request.start_date} → {request.end_date}
-- Time window: {request.start_hour}:00 to {request.end_hour}:00
 
-USER QUESTION:
-{request.custom_prompt}
+# Section events of the running calls that were started by a streaming request
+_inflight_streams: dict[str, _SectionBroadcast] = {}
 
-Provide a direct, actionable answer in 4-6 sentences. Be specific to this IKEA store.
-Include: what exactly to do, where in the store, expected impact, and how to measure success.
-Write a single cohesive paragraph without any headers or formatting."""
 
-        try:
-            message = client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=500,
-                system=followup_system,
-                messages=[{"role": "user", "content": followup_prompt}]
-            )
-            return InsightsResponse(
-                analysis="",
-                alarms=[],
-                actions=[],
-                answer=message.content[0].text.strip()
-            )
-        except anthropic.APIError as e:
-            raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
-
-    # System prompt for retail intelligence analyst role
-    system_prompt = """You are a senior retail intelligence analyst specialized in large-format IKEA stores.
-You understand customer flow psychology, forced vs voluntary behavior, layout intent vs actual usage, and how movement and dwell translate into conversion, friction, and operational cost.
-
-You are aware that tracking data is often sampled, noisy, and influenced by store constraints.
-Your task is to extract robust signals, identify risks, and propose concrete, testable actions.
-
-GLOBAL CONSTRAINTS (IMPORTANT):
+# Static prompt text lives at module scope; only the per-request context goes in the
+# user message. Prompt caching does not apply: the longest system prompt (SYSTEM_PROMPT
+# plus instructions) is about 400 tokens, below the 1,024-token minimum cacheable prefix
+# of claude-sonnet-4, so a cache_control breakpoint would never take effect.
+SYSTEM_PROMPT = """ROLE: Senior retail intelligence analyst for large-format IKEA stores.
+EXPERTISE: customer flow psychology; forced vs voluntary behavior; layout intent vs actual usage; how movement and dwell drive conversion, friction and operational cost.
+DATA: Tracking is sampled, noisy and shaped by store constraints. Extract robust signals, identify risks, propose concrete testable actions.
+CONSTRAINTS:
 - Do not over-interpret sampling noise
-- Prefer structural patterns over exact numbers
-- Avoid generic retail advice
+- Structural patterns over exact numbers
+- No generic retail advice
 - Do not restate what is visually obvious
-- Every recommendation must be intentional, testable, and measurable"""
-
-    # Build context and task based on mode
-    if request.mode == 'tracks':
-        total_db = request.total_in_database or 0
-        total_rendered = request.total_rendered or 0
-        prompt = f"""INPUT — TRACKS (Movement Density)
-
-Context:
-- Store: {store_name} (ID: {request.store_id})
-- Floor: {request.floor}
-- Date range: {request.start_date} → {request.end_date}
-- Time window: {request.start_hour}:00 to {request.end_hour}:00
-- Total tracking points in database: {total_db:,}
-- Points rendered / sampled: {total_rendered:,}
-- Zones defined: {request.zones_count or 0}
-- Visualization represents relative movement density, not absolute counts
+- Every recommendation intentional, testable and measurable"""
 
-Sampling note:
-The rendered data is a spatially representative sample.
-Insights should focus on persistent spatial patterns, not fine-grained intensity differences.
+FOLLOWUP_SYSTEM_PROMPT = """You are a senior retail intelligence analyst for IKEA stores.
+Provide direct, actionable answers. Be specific and practical.
+Do not use section headers or bullet points - write in clear paragraphs."""
 
-TASK — TRACKS
+TRACKS_INSTRUCTIONS = """TASK — TRACKS
 
 Analyze the movement density heatmap to understand how customers actually navigate the store.
 
@@ -153,37 +103,7 @@ Provide 3 actions, each explicit and intentional:
 
 Actions must be feasible inside a live IKEA store and suitable for A/B testing."""
 
-        # Add custom prompt if provided
-        if request.custom_prompt and request.custom_prompt.strip():
-            prompt += f"""
-
-ADDITIONAL USER REQUEST:
-{request.custom_prompt.strip()}
-
-Please incorporate this specific request into your analysis while maintaining the output format above."""
-
-    else:  # dwell mode
-        total_dwell = request.total_dwell_time or 0
-        avg_dwell = request.avg_dwell_time or 0
-        active_cells = request.active_cells or 0
-        prompt = f"""INPUT — DWELL (Time Spent / Engagement)
-
-Context:
-- Store: {store_name} (ID: {request.store_id})
-- Floor: {request.floor}
-- Date range: {request.start_date} → {request.end_date}
-- Time window: {request.start_hour}:00 to {request.end_hour}:00
-- Total dwell time recorded: {total_dwell:,} seconds ({total_dwell / 3600:.1f} hours)
-- Average dwell per active cell: {avg_dwell:.1f} seconds
-- Active dwell cells: {active_cells:,}
-- Zones defined: {request.zones_count or 0}
-- Visualization shows relative dwell intensity
-
-Note:
-High dwell does not automatically equal high engagement.
-Your analysis must distinguish intentional dwell from forced dwell.
-
-TASK — DWELL
+DWELL_INSTRUCTIONS = """TASK — DWELL
 
 Interpret where customers stop, hesitate, or engage, and what that implies for conversion and friction.
 
@@ -210,72 +130,403 @@ Provide 3 targeted actions, each specifying:
 - Where (zone type or store function)
 - Why it should improve engagement, conversion, or flow efficiency"""
 
-        # Add custom prompt if provided
-        if request.custom_prompt and request.custom_prompt.strip():
-            prompt += f"""
+
+# Store mapping for context
+STORE_NAMES = {
+    445: "IKEA Malmö, Sweden"
+}
+
+# Per-request user messages, filled from _prompt_context() with format_map. User text
+# is only ever passed as a value, so braces in it are never interpreted.
+FOLLOWUP_TEMPLATE = """Context:
+- Store: {store_name} (Floor {floor})
+- Date range: {start_date} → {end_date}
+- Time window: {start_hour}:00 to {end_hour}:00
+
+USER QUESTION:
+{question}
+
+Provide a direct, actionable answer in 4-6 sentences. Be specific to this IKEA store.
+Include: what exactly to do, where in the store, expected impact, and how to measure success.
+Write a single cohesive paragraph without any headers or formatting."""
+
+TRACKS_CONTEXT_TEMPLATE = """INPUT — TRACKS (Movement Density)
+
+Context:
+- Store: {store_name} (ID: {store_id})
+- Floor: {floor}
+- Date range: {start_date} → {end_date}
+- Time window: {start_hour}:00 to {end_hour}:00
+- Total tracking points in database: {total_db}
+- Points rendered / sampled: {total_rendered}
+- Zones defined: {zones_count}
+- Visualization represents relative movement density, not absolute counts
+
+Sampling note:
+The rendered data is a spatially representative sample.
+Insights should focus on persistent spatial patterns, not fine-grained intensity differences."""
+
+DWELL_CONTEXT_TEMPLATE = """INPUT — DWELL (Time Spent / Engagement)
+
+Context:
+- Store: {store_name} (ID: {store_id})
+- Floor: {floor}
+- Date range: {start_date} → {end_date}
+- Time window: {start_hour}:00 to {end_hour}:00
+- Total dwell time recorded: {total_dwell} seconds ({total_dwell_hours} hours)
+- Average dwell per active cell: {avg_dwell} seconds
+- Active dwell cells: {active_cells}
+- Zones defined: {zones_count}
+- Visualization shows relative dwell intensity
+
+Note:
+High dwell does not automatically equal high engagement.
+Your analysis must distinguish intentional dwell from forced dwell."""
+
+CUSTOM_REQUEST_TEMPLATE = """
 
 ADDITIONAL USER REQUEST:
-{request.custom_prompt.strip()}
+{custom_prompt}
 
-Please incorporate this specific request into your analysis while maintaining the output format above."""
+Please incorporate this specific request into your analysis while maintaining the required output format."""
 
+
+# Leading list markers such as "- ", "• ", "* ", "1. " or "2) " (possibly nested, e.g. "- 1. ")
+_BULLET_RE = re.compile(r"^\s*(?:(?:[-•*]|\d+[.)])\s+)+")
+
+
+# Section headers at the start of a line, e.g. "ALARMS", "ALARMS:", "## ALARMS" or "**ALARMS**"
+_SECTION_RE = re.compile(r"^[#*\s]*(ANALYSIS|ALARMS|ACTIONS)\b[*:]*", re.M)
+
+
+def _split_sections(text: str) -> dict[str, str]:
+    """Split a reply into its ANALYSIS/ALARMS/ACTIONS bodies in one pass (first header wins)."""
+    matches = list(_SECTION_RE.finditer(text))
+    sections = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        sections.setdefault(match.group(1), text[match.end():end].strip())
+    return sections
+
+
+# Instruction lines the model sometimes echoes back at the top of a list section
+_SECTION_ECHO_PREFIXES = {"ALARMS": "List", "ACTIONS": "Provide"}
+
+
+def _parse_items(name: str, body: str) -> list[str]:
+    """List items of an ALARMS/ACTIONS section body, without bullets (at most 3)."""
+    items = [
+        _BULLET_RE.sub("", line, count=1).strip()
+        for line in body.split("\n")
+        if line.strip() and not line.strip().startswith(_SECTION_ECHO_PREFIXES[name]) and len(line.strip()) > 3
+    ]
+    return items[:3]
+
+
+def _system_blocks(*texts: str) -> list[dict]:
+    """System prompt as one text block per part (no cache breakpoint, see SYSTEM_PROMPT)."""
+    return [{"type": "text", "text": text} for text in texts]
+
+
+def _log_usage(message) -> None:
+    usage = message.usage
+    logger.info(
+        "Insights usage: input=%s output=%s",
+        usage.input_tokens,
+        usage.output_tokens
+    )
+
+
+class InsightsRequest(BaseModel):
+    mode: Literal["tracks", "dwell"]
+    store_id: int
+    floor: int
+    start_date: date
+    end_date: date
+    start_hour: int = Field(ge=0, le=23)
+    end_hour: int = Field(ge=0, le=23)
+    # Tracks mode data
+    total_rendered: Optional[int] = None
+    total_in_database: Optional[int] = None
+    # Dwell mode data
+    total_dwell_time: Optional[int] = None
+    avg_dwell_time: Optional[float] = None
+    active_cells: Optional[int] = None
+    # Zone data
+    zones_count: Optional[int] = None
+    # Custom user prompt
+    custom_prompt: Optional[str] = None
+    # Follow-up flag for Q&A style responses
+    is_followup: bool = False
+
+    @model_validator(mode="after")
+    def _check_ranges(self) -> "InsightsRequest":
+        # Reject inverted ranges with a 422 here rather than spending a Claude call on them
+        if self.end_date < self.start_date:
+            raise ValueError("end_date must not be before start_date")
+        if self.end_hour < self.start_hour:
+            raise ValueError("end_hour must not be before start_hour")
+        return self
+
+
+class InsightsResponse(BaseModel):
+    analysis: str
+    alarms: list[str]
+    actions: list[str]
+    answer: Optional[str] = None  # For Q&A follow-up responses
+
+
+@router.post("/generate")
+async def generate_insights(
+    request: InsightsRequest,
+    client: AnthropicDep,
+    response: Response,
+    stream: bool = Query(False, description="Stream sections as server-sent events")
+) -> InsightsResponse:
+    """Generate AI insights based on heatmap/dwell data."""
+    if client is None:
+        raise HTTPException(status_code=500, detail="Anthropic API key not configured")
+
+    cache_key = hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+    insights = insights_cache.get(cache_key)
+    cache_status = "HIT" if insights is not None else "MISS"
+
+    if stream:
+        if insights is not None:
+            events = _replay_insights(insights)
+        elif cache_key in _inflight_streams:
+            events = _subscribe(_inflight_streams[cache_key])
+        elif cache_key in _inflight:
+            events = _replay_inflight(_inflight[cache_key])
+        else:
+            events = _subscribe(_start_stream(request, client, cache_key))
+        return StreamingResponse(events, media_type="text/event-stream", headers={"X-Cache": cache_status})
+
+    response.headers["X-Cache"] = cache_status
+    if insights is None:
+        # A running streaming call for the same request is shared too
+        task = _inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(_generate_and_cache(request, client, cache_key))
+            _inflight[cache_key] = task
+        # Shielded so a disconnecting caller does not cancel the call for the others
+        insights = await asyncio.shield(task)
+    return insights
+
+
+def _prompt_context(request: InsightsRequest) -> dict[str, str]:
+    """Every value the user prompt templates use, already formatted as text."""
+    total_dwell = request.total_dwell_time or 0
+    return {
+        "store_name": STORE_NAMES.get(request.store_id, f"IKEA Store {request.store_id}"),
+        "store_id": str(request.store_id),
+        "floor": str(request.floor),
+        "start_date": request.start_date.isoformat(),
+        "end_date": request.end_date.isoformat(),
+        "start_hour": str(request.start_hour),
+        "end_hour": str(request.end_hour),
+        "zones_count": str(request.zones_count or 0),
+        "total_db": f"{request.total_in_database or 0:,}",
+        "total_rendered": f"{request.total_rendered or 0:,}",
+        "total_dwell": f"{total_dwell:,}",
+        "total_dwell_hours": f"{total_dwell / 3600:.1f}",
+        "avg_dwell": f"{request.avg_dwell_time or 0:.1f}",
+        "active_cells": f"{request.active_cells or 0:,}"
+    }
+
+
+def _message_params(request: InsightsRequest) -> dict:
+    """Build the Claude request (model, system prompt, messages) for the request's mode."""
+    context = _prompt_context(request)
+
+    # Handle follow-up Q&A requests differently
+    if request.is_followup and request.custom_prompt:
+        followup_prompt = FOLLOWUP_TEMPLATE.format_map({**context, "question": request.custom_prompt})
+
+        return {
+            "model": "claude-sonnet-4-20250514",
+            "max_tokens": 500,
+            "system": _system_blocks(FOLLOWUP_SYSTEM_PROMPT),
+            "messages": [{"role": "user", "content": followup_prompt}]
+        }
+
+    # Build context and task based on mode
+    if request.mode == 'tracks':
+        instructions = TRACKS_INSTRUCTIONS
+        prompt = TRACKS_CONTEXT_TEMPLATE.format_map(context)
+    else:  # dwell mode
+        instructions = DWELL_INSTRUCTIONS
+        prompt = DWELL_CONTEXT_TEMPLATE.format_map(context)
+
+    # Add custom prompt if provided
+    if request.custom_prompt and request.custom_prompt.strip():
+        prompt += CUSTOM_REQUEST_TEMPLATE.format(custom_prompt=request.custom_prompt.strip())
+
+    return {
+        "model": "claude-sonnet-4-20250514",
+        "max_tokens": 1500,
+        "system": _system_blocks(SYSTEM_PROMPT, instructions),
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+
+
+def _is_followup(request: InsightsRequest) -> bool:
+    return bool(request.is_followup and request.custom_prompt)
+
+
+def _parse_reply(request: InsightsRequest, response_text: str) -> InsightsResponse:
+    """Parse Claude's reply into the response model."""
+    if _is_followup(request):
+        return InsightsResponse(analysis="", alarms=[], actions=[], answer=response_text.strip())
+
+    # Parse the response into sections
+    sections = _split_sections(response_text)
+    return InsightsResponse(
+        analysis=sections.get("ANALYSIS") or "Unable to generate analysis.",
+        alarms=_parse_items("ALARMS", sections.get("ALARMS", "")),
+        actions=_parse_items("ACTIONS", sections.get("ACTIONS", ""))
+    )
+
+
+def _error_status(e: anthropic.APIError) -> int:
+    """Map a Claude failure that outlived the client's retries to our response status."""
+    if isinstance(e, anthropic.RateLimitError):
+        return 429
+    if isinstance(e, anthropic.APIConnectionError):
+        return 502
+    if isinstance(e, anthropic.APIStatusError) and e.status_code >= 500:
+        return 502
+    return 500
+
+
+async def _generate_insights(request: InsightsRequest, client: anthropic.AsyncAnthropic) -> InsightsResponse:
+    """Call Claude and parse the complete reply."""
+    try:
+        message = await client.messages.create(**_message_params(request))
+    except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+        raise HTTPException(status_code=_error_status(e), detail=f"AI service error: {str(e)}")
+
+    _log_usage(message)
+    return _parse_reply(request, message.content[0].text)
+
+
+async def _generate_and_cache(
+    request: InsightsRequest,
+    client: anthropic.AsyncAnthropic,
+    cache_key: str
+) -> InsightsResponse:
+    try:
+        insights = await _generate_insights(request, client)
+        insights_cache.set(cache_key, insights)
+        return insights
+    finally:
+        del _inflight[cache_key]
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def _section_event(name: str, body: str) -> dict:
+    if name == "ANALYSIS":
+        return {"section": "analysis", "text": body.strip()}
+    return {"section": name.lower(), "items": _parse_items(name, body)}
+
+
+async def _replay_insights(insights: InsightsResponse) -> AsyncIterator[str]:
+    yield _sse({"done": True, **insights.model_dump()})
+
+
+async def _replay_inflight(task: asyncio.Task) -> AsyncIterator[str]:
     try:
-        message = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=1500,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
-        )
-
-        response_text = message.content[0].text
-
-        # Parse the response into sections
-        analysis = ""
-        alarms = []
-        actions = []
-
-        # Extract ANALYSIS section
-        if "ANALYSIS" in response_text:
-            analysis_start = response_text.find("ANALYSIS")
-            analysis_end = response_text.find("ALARMS")
-            if analysis_end == -1:
-                analysis_end = len(response_text)
-            analysis = response_text[analysis_start:analysis_end].replace("ANALYSIS", "").strip()
-            # Clean up any leading colons or newlines
-            analysis = analysis.lstrip(":").lstrip("\n").strip()
-
-        # Extract ALARMS section
-        if "ALARMS" in response_text:
-            alarms_start = response_text.find("ALARMS")
-            alarms_end = response_text.find("ACTIONS")
-            if alarms_end == -1:
-                alarms_end = len(response_text)
-            alarms_text = response_text[alarms_start:alarms_end].replace("ALARMS", "").strip()
-            alarms_text = alarms_text.lstrip(":").lstrip("\n").strip()
-            alarms = [
-                line.strip().lstrip("- ").lstrip("• ").lstrip("1.").lstrip("2.").lstrip("3.").strip()
-                for line in alarms_text.split("\n")
-                if line.strip() and not line.strip().startswith("List") and len(line.strip()) > 3
-            ]
-
-        # Extract ACTIONS section
-        if "ACTIONS" in response_text:
-            actions_start = response_text.find("ACTIONS")
-            actions_text = response_text[actions_start:].replace("ACTIONS", "").strip()
-            actions_text = actions_text.lstrip(":").lstrip("\n").strip()
-            actions = [
-                line.strip().lstrip("- ").lstrip("• ").lstrip("1.").lstrip("2.").lstrip("3.").strip()
-                for line in actions_text.split("\n")
-                if line.strip() and not line.strip().startswith("Provide") and len(line.strip()) > 3
-            ]
-
-        return InsightsResponse(
-            analysis=analysis or "Unable to generate analysis.",
-            alarms=alarms[:3],
-            actions=actions[:3]
-        )
-
-    except anthropic.APIError as e:
-        raise HTTPException(status_code=500, detail=f"AI service error: {str(e)}")
+        insights = await asyncio.shield(task)
+    except HTTPException as e:
+        yield _sse({"error": e.detail, "status": e.status_code})
+        return
+    except asyncio.CancelledError:
+        # Only the shared call being cancelled ends the stream with an error event;
+        # this stream's own cancellation (client gone) propagates
+        if not task.cancelled():
+            raise
+        yield _sse({"error": "AI service error", "status": 500})
+        return
+    except Exception:
+        yield _sse({"error": "AI service error", "status": 500})
+        return
+    yield _sse({"done": True, **insights.model_dump()})
+
+
+def _start_stream(
+    request: InsightsRequest,
+    client: anthropic.AsyncAnthropic,
+    cache_key: str
+) -> _SectionBroadcast:
+    """Start a streaming Claude call shared by every duplicate request while it runs."""
+    broadcast = _SectionBroadcast()
+    task = asyncio.create_task(_stream_insights(request, client, cache_key, broadcast))
+    # Stream subscribers read the events, not the result; retrieve a failure here so
+    # it is not reported as never retrieved when no JSON request awaited the task
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _inflight[cache_key] = task
+    _inflight_streams[cache_key] = broadcast
+    return broadcast
+
+
+async def _subscribe(broadcast: _SectionBroadcast) -> AsyncIterator[str]:
+    # A disconnecting client only stops reading; the shared call carries on
+    queue = broadcast.subscribe()
+    while True:
+        event = await queue.get()
+        yield _sse(event)
+        if "done" in event or "error" in event:
+            return
+
+
+async def _stream_insights(
+    request: InsightsRequest,
+    client: anthropic.AsyncAnthropic,
+    cache_key: str,
+    broadcast: _SectionBroadcast
+) -> InsightsResponse:
+    """Stream the reply, publishing section events to the broadcast.
+
+    Each section is published as soon as the next section header arrives; the last
+    event carries the full parsed response (the same shape as the JSON endpoint).
+    JSON requests that join the call await the returned response instead.
+    """
+    text = ""
+    sent = set()
+    try:
+        try:
+            async with client.messages.stream(**_message_params(request)) as stream:
+                async for delta in stream.text_stream:
+                    text += delta
+                    if _is_followup(request):
+                        continue
+                    matches = list(_SECTION_RE.finditer(text))
+                    for match, following in zip(matches, matches[1:]):
+                        name = match.group(1)
+                        if name not in sent:
+                            sent.add(name)
+                            broadcast.publish(_section_event(name, text[match.end():following.start()]))
+                message = await stream.get_final_message()
+        except (anthropic.APIStatusError, anthropic.APIConnectionError) as e:
+            raise HTTPException(status_code=_error_status(e), detail=f"AI service error: {str(e)}")
+
+        _log_usage(message)
+        insights = _parse_reply(request, text)
+        insights_cache.set(cache_key, insights)
+        broadcast.publish({"done": True, **insights.model_dump()})
+        return insights
+    except HTTPException as e:
+        broadcast.publish({"error": e.detail, "status": e.status_code})
+        raise
+    except BaseException:
+        # Never leave subscribers waiting for a last event
+        broadcast.publish({"error": "AI service error", "status": 500})
+        raise
+    finally:
+        del _inflight[cache_key]
+        del _inflight_streams[cache_key]
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 from app.api.deps import BigQueryServiceDep, SettingsDep
 from app.models.database import get_db, StoreModel
@@ -28,22 +29,28 @@ async def list_stores(
     result = await db.execute(select(StoreModel))
     store_metadata = {s.id: s for s in result.scalars().all()}
 
+    # Get floors for all stores in one query
+    store_floors = await bq_service.get_floors_for_stores([s["store_id"] for s in bq_stores])
+
+    # Values are already typed (BigQuery ids/floors, DB strings), so the response is
+    # built without validation and serialized directly
     stores = []
     for bq_store in bq_stores:
         store_id = bq_store["store_id"]
         metadata = store_metadata.get(store_id)
+        floors = store_floors[store_id]
 
-        # Get floors for this store
-        floors = await bq_service.get_store_floors(store_id)
-
-        stores.append(Store(
+        stores.append(Store.model_construct(
             store_id=store_id,
             name=metadata.name if metadata else f"Store {store_id}",
             country=metadata.country if metadata else "Unknown",
             floors=floors
         ))
 
-    return StoreListResponse(stores=stores)
+    return Response(
+        content=StoreListResponse.model_construct(stores=stores).model_dump_json(),
+        media_type="application/json"
+    )
 
 
 @router.get("/{store_id}")
@@ -54,8 +61,7 @@ async def get_store(
 ):
     """Get store details"""
     # Get store metadata
-    result = await db.execute(select(StoreModel).where(StoreModel.id == store_id))
-    metadata = result.scalar_one_or_none()
+    metadata = await db.get(StoreModel, store_id)
 
     # Get floors
     floors = await bq_service.get_store_floors(store_id)
@@ -76,23 +82,26 @@ async def update_store_metadata(
     db: AsyncSession = Depends(get_db)
 ):
     """Update store metadata (name, country)"""
-    result = await db.execute(select(StoreModel).where(StoreModel.id == store_id))
-    store = result.scalar_one_or_none()
-
-    if store:
-        store.name = name
-        store.country = country
-    else:
-        store = StoreModel(id=store_id, name=name, country=country)
-        db.add(store)
-
+    # One upsert statement; the conflict branch skips the write when nothing changed
+    stmt = sqlite_insert(StoreModel).values(id=store_id, name=name, country=country)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StoreModel.id],
+        set_={"name": stmt.excluded.name, "country": stmt.excluded.country},
+        where=or_(
+            StoreModel.name.is_distinct_from(stmt.excluded.name),
+            StoreModel.country.is_distinct_from(stmt.excluded.country)
+        )
+    ).returning(StoreModel.id, StoreModel.name, StoreModel.country)
+
+    result = await db.execute(stmt)
+    row = result.first()
     await db.commit()
-    await db.refresh(store)
 
+    # No row is returned when the stored values already matched
     return {
-        "store_id": store.id,
-        "name": store.name,
-        "country": store.country
+        "store_id": row.id if row else store_id,
+        "name": row.name if row else name,
+        "country": row.country if row else country
     }
 
 
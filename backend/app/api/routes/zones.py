@@ -1,16 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from pydantic import TypeAdapter
 from datetime import date
 from typing import Optional
 
-from app.api.deps import BigQueryServiceDep, SettingsDep
-from app.models.database import get_db, ZoneModel
+from app.api.deps import BigQueryServiceDep, ZoneCounterServiceDep
+from app.models.database import get_db, get_coordinate_offset, ZoneModel
 from app.models.schemas import Zone, ZoneCreate, ZoneUpdate, ZoneStats, ZoneStatsRequest
-from app.services.zone_counter import ZoneCounterService
 
 router = APIRouter()
 
+_zone_stats_list_adapter = TypeAdapter(list[ZoneStats])
+
+# Everything the Zone schema exposes, selected as plain rows so listings skip building ORM objects
+ZONE_COLUMNS = (
+    ZoneModel.id, ZoneModel.name, ZoneModel.store_id, ZoneModel.floor,
+    ZoneModel.x1, ZoneModel.y1, ZoneModel.x2, ZoneModel.y2, ZoneModel.created_at
+)
+
+
+def _to_zone(z) -> Zone:
+    """Build the API schema from a zone row or ORM object without re-validating typed columns."""
+    return Zone.model_construct(
+        id=z.id,
+        name=z.name,
+        store_id=z.store_id,
+        floor=z.floor,
+        x1=z.x1,
+        y1=z.y1,
+        x2=z.x2,
+        y2=z.y2,
+        created_at=z.created_at
+    )
+
 
 @router.get("/store/{store_id}", response_model=list[Zone])
 async def list_zones(
@@ -19,14 +42,13 @@ async def list_zones(
     db: AsyncSession = Depends(get_db)
 ):
     """List all zones for a store"""
-    query = select(ZoneModel).where(ZoneModel.store_id == store_id)
+    query = select(*ZONE_COLUMNS).where(ZoneModel.store_id == store_id)
     if floor is not None:
         query = query.where(ZoneModel.floor == floor)
 
     result = await db.execute(query)
-    zones = result.scalars().all()
 
-    return [Zone.model_validate(z) for z in zones]
+    return [_to_zone(row) for row in result]
 
 
 @router.get("/{zone_id}", response_model=Zone)
@@ -35,13 +57,12 @@ async def get_zone(
     db: AsyncSession = Depends(get_db)
 ):
     """Get a specific zone"""
-    result = await db.execute(select(ZoneModel).where(ZoneModel.id == zone_id))
-    zone = result.scalar_one_or_none()
+    zone = await db.get(ZoneModel, zone_id)
 
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
 
-    return Zone.model_validate(zone)
+    return _to_zone(zone)
 
 
 @router.post("", response_model=Zone)
@@ -64,7 +85,7 @@ async def create_zone(
     await db.commit()
     await db.refresh(db_zone)
 
-    return Zone.model_validate(db_zone)
+    return _to_zone(db_zone)
 
 
 @router.put("/{zone_id}", response_model=Zone)
@@ -74,8 +95,7 @@ async def update_zone(
     db: AsyncSession = Depends(get_db)
 ):
     """Update a zone"""
-    result = await db.execute(select(ZoneModel).where(ZoneModel.id == zone_id))
-    zone = result.scalar_one_or_none()
+    zone = await db.get(ZoneModel, zone_id)
 
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
@@ -94,7 +114,7 @@ async def update_zone(
     await db.commit()
     await db.refresh(zone)
 
-    return Zone.model_validate(zone)
+    return _to_zone(zone)
 
 
 @router.delete("/{zone_id}")
@@ -103,8 +123,7 @@ async def delete_zone(
     db: AsyncSession = Depends(get_db)
 ):
     """Delete a zone"""
-    result = await db.execute(select(ZoneModel).where(ZoneModel.id == zone_id))
-    zone = result.scalar_one_or_none()
+    zone = await db.get(ZoneModel, zone_id)
 
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
@@ -115,11 +134,13 @@ async def delete_zone(
     return {"message": "Zone deleted", "zone_id": zone_id}
 
 
-@router.get("/{zone_id}/stats", response_model=ZoneStats)
+# The stats routes document ZoneStats but skip FastAPI's output validation and encoding:
+# the service builds the dicts itself, so they are shaped with model_construct and
+# serialized straight to JSON
+@router.get("/{zone_id}/stats", response_model=None, responses={200: {"model": ZoneStats}})
 async def get_zone_stats(
     zone_id: int,
-    bq_service: BigQueryServiceDep,
-    settings: SettingsDep,
+    zone_counter: ZoneCounterServiceDep,
     start_date: date = Query(..., description="Start date"),
     end_date: date = Query(..., description="End date"),
     start_hour: int = Query(0, ge=0, le=23),
@@ -129,25 +150,15 @@ async def get_zone_stats(
 ):
     """Get visitor statistics for a zone"""
     # Get zone
-    result = await db.execute(select(ZoneModel).where(ZoneModel.id == zone_id))
-    zone = result.scalar_one_or_none()
+    zone = await db.get(ZoneModel, zone_id)
 
     if not zone:
         raise HTTPException(status_code=404, detail="Zone not found")
 
-    zone_counter = ZoneCounterService(bq_service, settings)
-
     stats = await zone_counter.get_zone_stats(
         store_id=zone.store_id,
         floor=zone.floor,
-        zones=[{
-            "id": zone.id,
-            "name": zone.name,
-            "x1": zone.x1,
-            "y1": zone.y1,
-            "x2": zone.x2,
-            "y2": zone.y2
-        }],
+        zones=[zone.to_geom_dict()],
         start_date=start_date,
         end_date=end_date,
         start_hour=start_hour,
@@ -155,19 +166,19 @@ async def get_zone_stats(
         include_dwell=include_dwell
     )
 
-    return stats[0] if stats else ZoneStats(
+    zone_stats = ZoneStats.model_construct(**stats[0]) if stats else ZoneStats(
         zone_id=zone_id,
         zone_name=zone.name,
         track_count=0,
         unique_visitors=0
     )
+    return Response(content=zone_stats.model_dump_json(), media_type="application/json")
 
 
-@router.post("/stats", response_model=list[ZoneStats])
+@router.post("/stats", response_model=None, responses={200: {"model": list[ZoneStats]}})
 async def get_multiple_zone_stats(
     request: ZoneStatsRequest,
-    bq_service: BigQueryServiceDep,
-    settings: SettingsDep,
+    zone_counter: ZoneCounterServiceDep,
     include_dwell: bool = Query(False),
     db: AsyncSession = Depends(get_db)
 ):
@@ -184,19 +195,10 @@ async def get_multiple_zone_stats(
     if not zones:
         return []
 
-    zone_counter = ZoneCounterService(bq_service, settings)
-
     stats = await zone_counter.get_zone_stats(
         store_id=request.store_id,
         floor=zones[0].floor,  # Assuming all zones are on same floor
-        zones=[{
-            "id": z.id,
-            "name": z.name,
-            "x1": z.x1,
-            "y1": z.y1,
-            "x2": z.x2,
-            "y2": z.y2
-        } for z in zones],
+        zones=[z.to_geom_dict() for z in zones],
         start_date=request.start_date,
         end_date=request.end_date,
         start_hour=request.start_hour,
@@ -204,7 +206,10 @@ async def get_multiple_zone_stats(
         include_dwell=include_dwell
     )
 
-    return stats
+    return Response(
+        content=_zone_stats_list_adapter.dump_json([ZoneStats.model_construct(**stat) for stat in stats]),
+        media_type="application/json"
+    )
 
 
 @router.get("/coverage/{store_id}")
@@ -232,16 +237,12 @@ async def get_zone_coverage(
         return {"error": "No zones defined for this store/floor"}
 
     # Get coordinate offset
-    from app.api.routes.heatmap import get_coordinate_offset
     offset_x, offset_y = await get_coordinate_offset(store_id, floor)
 
     coverage = await bq_service.get_visitors_outside_zones(
         store_id=store_id,
         floor=floor,
-        zones=[{
-            "x1": z.x1, "y1": z.y1,
-            "x2": z.x2, "y2": z.y2
-        } for z in zones],
+        zones=[z.to_geom_dict() for z in zones],
         start_date=start_date,
         end_date=end_date,
         start_hour=start_hour,
@@ -283,17 +284,12 @@ async def get_track_completeness(
         return {"error": "No zones defined for this store/floor"}
 
     # Get coordinate offset
-    from app.api.routes.heatmap import get_coordinate_offset
     offset_x, offset_y = await get_coordinate_offset(store_id, floor)
 
     completeness = await bq_service.get_track_completeness(
         store_id=store_id,
         floor=floor,
-        zones=[{
-            "name": z.name,
-            "x1": z.x1, "y1": z.y1,
-            "x2": z.x2, "y2": z.y2
-        } for z in zones],
+        zones=[z.to_geom_dict() for z in zones],
         start_date=start_date,
         end_date=end_date,
         start_hour=start_hour,
@@ -319,24 +315,18 @@ async def get_zone_track_quality(
     Get track quality for a specific zone.
     Shows complete vs incomplete tracks (tracks that start/end inside zone without proper entry/exit).
     """
-    result = await db.execute(select(ZoneModel).where(ZoneModel.id == zone_id))
-    zone = result.scalar_one_or_none()
+    zone = await db.get(ZoneModel, zone_id)
 
     if not zone:
         return {"error": "Zone not found"}
 
     # Get coordinate offset
-    from app.api.routes.heatmap import get_coordinate_offset
     offset_x, offset_y = await get_coordinate_offset(zone.store_id, zone.floor)
 
     quality = await bq_service.get_zone_track_quality(
         store_id=zone.store_id,
         floor=zone.floor,
-        zone={
-            "name": zone.name,
-            "x1": zone.x1, "y1": zone.y1,
-            "x2": zone.x2, "y2": zone.y2
-        },
+        zone=zone.to_geom_dict(),
         start_date=start_date,
         end_date=end_date,
         start_hour=start_hour,
@@ -346,3 +336,45 @@ async def get_zone_track_quality(
     )
 
     return quality
+
+
+@router.get("/quality/store/{store_id}")
+async def get_zones_track_quality(
+    store_id: int,
+    bq_service: BigQueryServiceDep,
+    floor: int = Query(1),
+    start_date: date = Query(...),
+    end_date: date = Query(...),
+    start_hour: int = Query(0, ge=0, le=23),
+    end_hour: int = Query(23, ge=0, le=23),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get track quality for every zone of a store/floor, computed in one query."""
+    # Get zones for this store/floor
+    result = await db.execute(
+        select(ZoneModel).where(
+            ZoneModel.store_id == store_id,
+            ZoneModel.floor == floor
+        )
+    )
+    zones = result.scalars().all()
+
+    if not zones:
+        return {"error": "No zones defined for this store/floor"}
+
+    # Get coordinate offset
+    offset_x, offset_y = await get_coordinate_offset(store_id, floor)
+
+    qualities = await bq_service.get_zones_track_quality(
+        store_id=store_id,
+        floor=floor,
+        zones=[z.to_geom_dict() for z in zones],
+        start_date=start_date,
+        end_date=end_date,
+        start_hour=start_hour,
+        end_hour=end_hour,
+        offset_x=offset_x,
+        offset_y=offset_y
+    )
+
+    return [{"zone_id": zone.id, **quality} for zone, quality in zip(zones, qualities)]
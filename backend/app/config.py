@@ -1,5 +1,5 @@
-from pydantic_settings import BaseSettings
-from functools import lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import cached_property, lru_cache
 
 
 class Settings(BaseSettings):
@@ -7,6 +7,14 @@ class Settings(BaseSettings):
     gcp_project_id: str = "ingka-sot-cfm-dev"
     bq_dataset: str = ""
     bq_table: str = ""
+    # Optional hourly rollup of bq_table (see BigQueryService.create_rollup), in the same
+    # dataset. Empty means every query scans the raw table.
+    bq_rollup_table: str = ""
+    # Optional INT64 column of bq_table holding the hour of day of `timestamp`, filled at
+    # load time. Empty means the hour is derived from `timestamp` in every query.
+    bq_hour_column: str = ""
+    # Per-query cap on billed bytes; a query that would scan more fails instead. 0 = no cap.
+    bq_max_bytes_billed: int = 0
 
     # Heatmap Configuration
     heatmap_grid_size: float = 1.0  # meters
@@ -14,6 +22,9 @@ class Settings(BaseSettings):
     # Dwell Time Configuration
     dwell_spatial_threshold: float = 2.0  # meters
     dwell_min_time: int = 30  # seconds
+    # Find stationary periods in BigQuery over all points instead of clustering up to
+    # 200k sampled points here (periods split on the distance between consecutive points)
+    dwell_in_bigquery: bool = False
 
     # Server Configuration
     cors_origins: list[str] = ["http://localhost:5173", "http://localhost:3000"]
@@ -21,17 +32,22 @@ class Settings(BaseSettings):
     # Storage paths
     upload_dir: str = "uploads"
     floorplans_dir: str = "uploads/floorplans"
+    max_upload_bytes: int = 50 * 1024 * 1024
 
     # AI Insights
     anthropic_api_key: str = ""
 
-    @property
+    @cached_property
     def bq_full_table_id(self) -> str:
         return f"{self.gcp_project_id}.{self.bq_dataset}.{self.bq_table}"
 
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
+    @cached_property
+    def bq_rollup_table_id(self) -> str:
+        if not self.bq_rollup_table:
+            return ""
+        return f"{self.gcp_project_id}.{self.bq_dataset}.{self.bq_rollup_table}"
+
+    model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 
 @lru_cache()
@@ -1,12 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import anthropic
 import os
 
 from app.config import get_settings
+from app.api.responses import ImmutableStaticFiles, ORJSONResponse
 from app.api.routes import stores, heatmap, dwell, zones, floorplans, insights
-from app.models.database import init_db
+from app.models.database import init_db, open_sqlite, close_sqlite
 
 
 @asynccontextmanager
@@ -20,17 +21,33 @@ async def lifespan(app: FastAPI):
 
     # Initialize database
     await init_db()
+    await open_sqlite()
+
+    # One Anthropic client (and connection pool) for all insight requests. Rate limit
+    # and overloaded responses are retried by the SDK with exponential backoff.
+    app.state.anthropic = (
+        anthropic.AsyncAnthropic(
+            api_key=settings.anthropic_api_key,
+            max_retries=4,
+            timeout=anthropic.Timeout(60.0, connect=5.0)
+        )
+        if settings.anthropic_api_key else None
+    )
 
     yield
     # Shutdown
-    pass
+    await close_sqlite()
+    if app.state.anthropic is not None:
+        await app.state.anthropic.close()
 
 
 app = FastAPI(
     title="IKEA Store Tracking Heatmap API",
     description="API for visualizing store tracking data with heatmaps, dwell time analysis, and zone counting",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    # Heatmap payloads run to hundreds of thousands of points; orjson encodes them much faster
+    default_response_class=ORJSONResponse
 )
 
 # CORS middleware
@@ -43,8 +60,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Static files for floor plans
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Static files for floor plans (long-lived browser caching; see ImmutableStaticFiles)
+app.mount("/uploads", ImmutableStaticFiles(directory="uploads"), name="uploads")
 
 # Include routers
 app.include_router(stores.router, prefix="/api/stores", tags=["stores"])
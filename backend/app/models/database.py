@@ -1,21 +1,47 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, Integer, Float, DateTime
+from sqlalchemy import String, Integer, Float, DateTime, Index, event
 from datetime import datetime
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
+import aiosqlite
+import os
+
+from app.utils.cache import TTLCache
 
 DATABASE_URL = "sqlite+aiosqlite:///./tracking.db"
 
+# Path to SQLite database for direct (non-ORM) queries
+DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "tracking.db")
+
+# Applied to every SQLite connection: WAL lets readers run alongside a writer and,
+# with synchronous=NORMAL, commits append to the WAL instead of fsyncing each time.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+)
+
 engine = create_async_engine(DATABASE_URL, echo=False)
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
 class Base(DeclarativeBase):
     pass
 
 
 class ZoneModel(Base):
     __tablename__ = "zones"
+    __table_args__ = (Index("ix_zones_store_floor", "store_id", "floor"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(255))
@@ -27,6 +53,17 @@ class ZoneModel(Base):
     y2: Mapped[float] = mapped_column(Float)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
+    def to_geom_dict(self) -> dict:
+        """Zone identity and rectangle in the dict shape the BigQuery and zone counter services take."""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "x1": self.x1,
+            "y1": self.y1,
+            "x2": self.x2,
+            "y2": self.y2
+        }
+
 
 class FloorPlanModel(Base):
     __tablename__ = "floorplans"
@@ -46,6 +83,15 @@ class FloorPlanModel(Base):
     adjust_offset_y: Mapped[float] = mapped_column(Float, default=0.0)
     adjust_scale: Mapped[float] = mapped_column(Float, default=1.0)
     adjust_rotation: Mapped[float] = mapped_column(Float, default=0.0)
+    adjust_scale_x: Mapped[Optional[float]] = mapped_column(Float, default=1.0, nullable=True)
+    adjust_scale_y: Mapped[Optional[float]] = mapped_column(Float, default=1.0, nullable=True)
+    # Affine transform (when set, overrides simple adjustments)
+    affine_a: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    affine_b: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    affine_c: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    affine_d: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    affine_tx: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    affine_ty: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
@@ -59,9 +105,98 @@ class StoreModel(Base):
 
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        result = await conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'index')"
+        )
+        existing = {row[0] for row in result.fetchall()}
+
+        # create_all checks and creates each model's table in turn; on restarts the
+        # schema is already there, so one catalog read is enough
+        if not set(Base.metadata.tables) <= existing:
+            await conn.run_sync(Base.metadata.create_all)
+
+        # Zone listings and coverage queries filter on (store_id, floor); create_all
+        # skips indexes on tables that already exist
+        if "ix_zones_store_floor" not in existing:
+            await conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS ix_zones_store_floor ON zones (store_id, floor)"
+            )
+
+        # Every heatmap/dwell/zone request looks up a floor's offset by (store_id, floor).
+        # offset_x/offset_y live outside the ORM, so the index only covers them when present.
+        if "idx_floorplans_store_floor_offset" in existing:
+            return
+        result = await conn.exec_driver_sql("PRAGMA table_info(floorplans)")
+        columns = {row[1] for row in result.fetchall()}
+        if {"offset_x", "offset_y"} <= columns:
+            await conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS idx_floorplans_store_floor_offset "
+                "ON floorplans (store_id, floor, offset_x, offset_y)"
+            )
+        elif "idx_floorplans_store_floor" not in existing:
+            await conn.exec_driver_sql(
+                "CREATE INDEX IF NOT EXISTS idx_floorplans_store_floor ON floorplans (store_id, floor)"
+            )
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
+
+
+# Hot-path statements for the shared connection. sqlite3 keeps compiled statements
+# in a per-connection cache keyed by SQL text, so reusing one constant skips re-parsing.
+SQL_FLOORPLAN_OFFSET = "SELECT offset_x, offset_y FROM floorplans WHERE store_id = ? AND floor = ?"
+
+
+# Floor plan offsets by (store_id, floor), looked up by nearly every heatmap, dwell and
+# zone request. The floor plan routes invalidate an entry whenever they write that plan.
+offset_cache = TTLCache(ttl=300, maxsize=256)
+
+
+# Shared connection for direct reads, opened once in the app lifespan.
+# Writes go through the ORM sessions (get_db), never through this connection.
+_sqlite: Optional[aiosqlite.Connection] = None
+
+
+async def open_sqlite() -> aiosqlite.Connection:
+    global _sqlite
+    if _sqlite is None:
+        _sqlite = await aiosqlite.connect(DB_PATH, cached_statements=256)
+        for pragma in SQLITE_PRAGMAS:
+            await _sqlite.execute(pragma)
+    return _sqlite
+
+
+async def close_sqlite():
+    global _sqlite
+    if _sqlite is not None:
+        await _sqlite.close()
+        _sqlite = None
+
+
+def get_sqlite() -> aiosqlite.Connection:
+    if _sqlite is None:
+        raise RuntimeError("open_sqlite() must run in the app lifespan first")
+    return _sqlite
+
+
+async def get_coordinate_offset(store_id: int, floor: int) -> tuple[float, float]:
+    """Get coordinate offset for a floor plan (to align tracking data with floor plan)."""
+    key = (store_id, floor)
+    offset = offset_cache.get(key)
+    if offset is not None:
+        return offset
+
+    try:
+        db = get_sqlite()
+        async with db.execute(SQL_FLOORPLAN_OFFSET, (store_id, floor)) as cursor:
+            row = await cursor.fetchone()
+    except Exception:
+        return 0.0, 0.0
+
+    offset = 0.0, 0.0
+    if row and row[0] is not None and row[1] is not None:
+        offset = row[0], row[1]  # offset_x (longitude), offset_y (latitude)
+    offset_cache.set(key, offset)
+    return offset
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 from datetime import date, datetime
-from typing import Optional
+from typing import Literal, Optional
+from typing_extensions import TypedDict
 
 
 # Store schemas
@@ -48,15 +49,6 @@ class FloorPlan(BaseModel):
     created_at: datetime
 
 
-class FloorPlanCreate(BaseModel):
-    store_id: int
-    floor: int
-    data_min_x: float = 0.0
-    data_max_x: float = 100.0
-    data_min_y: float = 0.0
-    data_max_y: float = 100.0
-
-
 class FloorPlanCalibration(BaseModel):
     data_min_x: float
     data_max_x: float
@@ -79,42 +71,62 @@ class FloorPlanAdjustment(BaseModel):
     affine_tx: Optional[float] = None
     affine_ty: Optional[float] = None
 
+    @model_validator(mode="after")
+    def _check_affine(self) -> "FloorPlanAdjustment":
+        # The six coefficients form one matrix; clients apply it whenever affine_a is set
+        coefficients = (self.affine_a, self.affine_b, self.affine_c,
+                        self.affine_d, self.affine_tx, self.affine_ty)
+        if any(v is None for v in coefficients) and any(v is not None for v in coefficients):
+            raise ValueError("affine coefficients must be all set or all null")
+        return self
+
 
 # Heatmap schemas
 class HeatmapRequest(BaseModel):
     store_id: int
-    floor: int = 0
+    floor: int = Field(0, strict=True)
     start_date: date
     end_date: date
-    start_hour: int = Field(0, ge=0, le=23)
-    end_hour: int = Field(23, ge=0, le=23)
+    start_hour: int = Field(0, strict=True, ge=0, le=23)
+    end_hour: int = Field(23, strict=True, ge=0, le=23)
+    layout: Literal["rows", "columns"] = "rows"  # "columns" returns points as {x: [...], y: [...]}
+
 
+# Point and cell rows stay plain dicts end to end (one model per point would dominate
+# large responses); these TypedDicts only describe their shape
+class RawPoint(TypedDict):
+    x: float  # longitude + floor plan offset
+    y: float  # latitude + floor plan offset
 
-class RawPoint(BaseModel):
-    x: float  # latitude
-    y: float  # longitude
+
+class Bounds(TypedDict):
+    min_x: float
+    max_x: float
+    min_y: float
+    max_y: float
 
 
 class HeatmapResponse(BaseModel):
     points: list[RawPoint]
-    bounds: dict  # {"min_x", "max_x", "min_y", "max_y"}
+    bounds: Bounds
     total_returned: int
 
 
 # Dwell time schemas
 class DwellTimeRequest(BaseModel):
     store_id: int
-    floor: int = 0
+    floor: int = Field(0, strict=True)
     start_date: date
     end_date: date
-    start_hour: int = Field(0, ge=0, le=23)
-    end_hour: int = Field(23, ge=0, le=23)
-    min_dwell_seconds: int = 30
+    start_hour: int = Field(0, strict=True, ge=0, le=23)
+    end_hour: int = Field(23, strict=True, ge=0, le=23)
+    min_dwell_seconds: int = Field(30, ge=0)
     max_dwell_seconds: Optional[int] = None
-    grid_size: Optional[float] = None
+    grid_size: Optional[float] = Field(None, gt=0)
+    layout: Literal["rows", "columns"] = "rows"  # "columns" returns cells as {x: [...], y: [...], ...}
 
 
-class DwellTimeCell(BaseModel):
+class DwellTimeCell(TypedDict):
     x: float
     y: float
     total_dwell_seconds: int
@@ -125,7 +137,7 @@ class DwellTimeCell(BaseModel):
 class DwellTimeResponse(BaseModel):
     cells: list[DwellTimeCell]
     grid_size: float
-    bounds: dict
+    bounds: Bounds
     total_dwell_time: int
     avg_dwell_time: float
 
@@ -134,7 +146,7 @@ class DwellTimeResponse(BaseModel):
 class ZoneBase(BaseModel):
     name: str
     store_id: int
-    floor: int = 0
+    floor: int = Field(0, strict=True)
     x1: float  # top-left x
     y1: float  # top-left y
     x2: float  # bottom-right x
@@ -154,14 +166,16 @@ class ZoneUpdate(BaseModel):
 
 
 class Zone(ZoneBase):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
 class ZoneStats(BaseModel):
+    # Built from service rows with model_construct and never modified afterwards
+    model_config = ConfigDict(frozen=True)
+
     zone_id: int
     zone_name: str
     track_count: int
@@ -175,15 +189,17 @@ class ZoneStatsRequest(BaseModel):
     zone_ids: list[int]
     start_date: date
     end_date: date
-    start_hour: int = Field(0, ge=0, le=23)
-    end_hour: int = Field(23, ge=0, le=23)
+    start_hour: int = Field(0, strict=True, ge=0, le=23)
+    end_hour: int = Field(23, strict=True, ge=0, le=23)
 
 
 # Track data schema (raw)
 class TrackPoint(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     hash_id: str
     latitude: float
     longitude: float
     timestamp: int
-    floor: int
+    floor: int = Field(strict=True)
     uncertainty: int
@@ -1,20 +1,218 @@
-from google.cloud import bigquery
-from google.cloud.bigquery import QueryJobConfig, ScalarQueryParameter
+from google.auth.transport.requests import AuthorizedSession
+from google.cloud import bigquery, bigquery_storage
+from google.cloud.bigquery import ArrayQueryParameter, QueryJobConfig, ScalarQueryParameter
 from datetime import date
-from typing import Optional
+from typing import Callable, Iterable, Optional, TypeVar
+import asyncio
 import logging
+import numpy as np
+import google.auth
+import pyarrow as pa
+import pyarrow.compute as pc
+import requests
 
 from app.config import Settings
+from app.utils.cache import cached_query
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Spatial bin of the hourly rollup, in degrees (~0.5 meters)
+ROLLUP_BIN_SIZE = 0.000005
+
+# HTTP connections kept open to the BigQuery API. Queries run in worker threads
+# (asyncio.to_thread), so this matches the default thread pool's upper bound; the
+# requests default of 10 made concurrent queries wait for, or reopen, connections.
+HTTP_POOL_SIZE = 32
+
+# Columns returned by get_raw_tracks unless a caller asks for fewer
+RAW_TRACK_COLUMNS = ("hash_id", "latitude", "longitude", "timestamp", "floor", "uncertainty")
+
+
+def count_distinct(expr: str, exact: bool = False) -> str:
+    """SQL for a distinct count of expr.
+
+    Uses BigQuery's HyperLogLog++ estimate (about 1% error, fixed memory per group)
+    unless an exact count is asked for.
+    """
+    return f"COUNT(DISTINCT {expr})" if exact else f"APPROX_COUNT_DISTINCT({expr})"
+
+
+def zone_bounds_params(zones: list[dict], offset_x: float, offset_y: float) -> list[ArrayQueryParameter]:
+    """Zone rectangles as parallel @lon_min/@lon_max/@lat_min/@lat_max array parameters.
+
+    Zone coords are in data space (x = longitude + offset, y = latitude + offset), so the
+    offset is subtracted to get raw lat/lon. Zone i is `@lon_min[OFFSET(i)]` etc. in SQL,
+    which keeps the query text the same for any zone layout of the same size.
+    """
+    return [
+        ArrayQueryParameter("lon_min", "FLOAT64", [min(z["x1"], z["x2"]) - offset_x for z in zones]),
+        ArrayQueryParameter("lon_max", "FLOAT64", [max(z["x1"], z["x2"]) - offset_x for z in zones]),
+        ArrayQueryParameter("lat_min", "FLOAT64", [min(z["y1"], z["y2"]) - offset_y for z in zones]),
+        ArrayQueryParameter("lat_max", "FLOAT64", [max(z["y1"], z["y2"]) - offset_y for z in zones]),
+    ]
+
+
+# One row per zone of zone_bounds_params, for joining rows against all zones at once
+ZONES_SQL = """
+                SELECT
+                    zone_idx,
+                    @lon_min[OFFSET(zone_idx)] AS lon_min,
+                    @lon_max[OFFSET(zone_idx)] AS lon_max,
+                    @lat_min[OFFSET(zone_idx)] AS lat_min,
+                    @lat_max[OFFSET(zone_idx)] AS lat_max
+                FROM UNNEST(GENERATE_ARRAY(0, ARRAY_LENGTH(@lon_min) - 1)) AS zone_idx
+"""
+
+
+def in_zone_sql(i: int) -> str:
+    """SQL condition for a row lying inside zone i of zone_bounds_params."""
+    return (
+        f"longitude BETWEEN @lon_min[OFFSET({i})] AND @lon_max[OFFSET({i})] "
+        f"AND latitude BETWEEN @lat_min[OFFSET({i})] AND @lat_max[OFFSET({i})]"
+    )
+
+
+def columns_or_rows(table: pa.Table, layout: str) -> list[dict] | dict[str, np.ndarray]:
+    """A result table as a list of row dicts, or as {column: array} for layout="columns"."""
+    if layout == "columns":
+        return {name: table.column(name).to_numpy() for name in table.column_names}
+    return table.to_pylist()
+
 
 class BigQueryService:
     def __init__(self, settings: Settings):
         self.settings = settings
-        self.client = bigquery.Client(project=settings.gcp_project_id)
+        # Credentials are resolved once and shared by both clients
+        credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+        session = AuthorizedSession(credentials)
+        session.mount("https://", requests.adapters.HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+        ))
+        self.client = bigquery.Client(project=settings.gcp_project_id, credentials=credentials, _http=session)
+        # Large results (raw points) are downloaded as Arrow over the Storage Read API
+        self.bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
         self.table_id = settings.bq_full_table_id
+        self.rollup_table_id = settings.bq_rollup_table_id
+        # Hour-of-day filter: a precomputed column when the table has one, else derived per row
+        self.hour_expr = settings.bq_hour_column or "EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp))"
+
+    def _job_config(self, job_config: Optional[QueryJobConfig], label: Optional[str]) -> QueryJobConfig:
+        """Standard SQL with BigQuery's result cache, labelled for billing exports.
+
+        Jobs run at interactive priority unless the caller asked for batch, and are
+        capped at bq_max_bytes_billed (if set) so an oversized date range fails
+        instead of scanning the whole table.
+        """
+        job_config = job_config or QueryJobConfig()
+        job_config.use_legacy_sql = False
+        job_config.use_query_cache = True
+        job_config.priority = job_config.priority or bigquery.QueryPriority.INTERACTIVE
+        if self.settings.bq_max_bytes_billed and job_config.maximum_bytes_billed is None:
+            job_config.maximum_bytes_billed = self.settings.bq_max_bytes_billed
+        job_config.labels = {"service": "tracking-heatmap", **({"method": label} if label else {})}
+        return job_config
+
+    async def run_query(
+        self,
+        query: str,
+        job_config: Optional[QueryJobConfig] = None,
+        label: Optional[str] = None
+    ) -> list:
+        """Run a query and fetch all rows in a worker thread so the event loop stays free.
+
+        label names the caller in the job's labels.
+        """
+        job_config = self._job_config(job_config, label)
+        return await asyncio.to_thread(
+            lambda: list(self.client.query(query, job_config=job_config).result())
+        )
+
+    async def run_query_one(
+        self,
+        query: str,
+        job_config: Optional[QueryJobConfig] = None,
+        label: Optional[str] = None
+    ):
+        """Run a single-row (aggregate) query and return that row, or None if there is none.
+
+        Only the first row is requested from the API, no list is built.
+        """
+        job_config = self._job_config(job_config, label)
+        return await asyncio.to_thread(
+            lambda: next(iter(self.client.query(query, job_config=job_config).result(max_results=1)), None)
+        )
+
+    async def run_query_arrow(
+        self,
+        query: str,
+        job_config: Optional[QueryJobConfig] = None,
+        label: Optional[str] = None
+    ) -> pa.Table:
+        """Run a query and download the result as an Arrow table in a worker thread.
+
+        Uses the Storage Read API, which streams columnar batches instead of
+        paginated JSON rows.
+        """
+        job_config = self._job_config(job_config, label)
+        return await asyncio.to_thread(
+            lambda: self.client.query(query, job_config=job_config).result().to_arrow(
+                bqstorage_client=self.bqstorage_client
+            )
+        )
+
+    async def run_query_batches(
+        self,
+        query: str,
+        read: Callable[[Iterable[pa.RecordBatch], int], T],
+        job_config: Optional[QueryJobConfig] = None,
+        label: Optional[str] = None
+    ) -> T:
+        """Run a query and stream its result as Arrow record batches in a worker thread.
+
+        read(batches, total_rows) is called in that thread and its return value is
+        returned; only one batch of the result is held at a time, so read can build
+        its output incrementally instead of from a full table.
+        """
+        job_config = self._job_config(job_config, label)
+
+        def run() -> T:
+            rows = self.client.query(query, job_config=job_config).result()
+            return read(rows.to_arrow_iterable(bqstorage_client=self.bqstorage_client), rows.total_rows or 0)
+
+        return await asyncio.to_thread(run)
+
+    async def create_rollup(self) -> None:
+        """Create the hourly rollup named by the bq_rollup_table setting (one-time setup).
 
+        A materialized view of track counts and HyperLogLog++ visitor sketches per
+        store, floor, date, hour and ~0.5 m spatial bin. BigQuery keeps it up to date,
+        and floor totals and zone stats merge its sketches instead of rescanning raw rows.
+        """
+        if not self.rollup_table_id:
+            raise ValueError("bq_rollup_table is not configured")
+
+        query = f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS `{self.rollup_table_id}` AS
+        SELECT
+            store_id,
+            floor,
+            date,
+            {self.hour_expr} as hour,
+            ROUND(longitude / {ROLLUP_BIN_SIZE}) * {ROLLUP_BIN_SIZE} as bin_x,
+            ROUND(latitude / {ROLLUP_BIN_SIZE}) * {ROLLUP_BIN_SIZE} as bin_y,
+            COUNT(*) as track_count,
+            HLL_COUNT.INIT(hash_id) as visitors
+        FROM `{self.table_id}`
+        GROUP BY store_id, floor, date, hour, bin_x, bin_y
+        """
+        # Setup work, kept off the interactive slots used by the app's queries
+        await self.run_query(
+            query, QueryJobConfig(priority=bigquery.QueryPriority.BATCH), label="create_rollup"
+        )
+
+    @cached_query()
     async def get_stores(self) -> list[dict]:
         """Get distinct stores from tracking data"""
         query = f"""
@@ -23,13 +221,13 @@ class BigQueryService:
         ORDER BY store_id
         """
         try:
-            query_job = self.client.query(query)
-            results = query_job.result()
+            results = await self.run_query(query, label="get_stores")
             return [{"store_id": row.store_id} for row in results]
         except Exception as e:
             logger.error(f"Error fetching stores: {e}")
             raise
 
+    @cached_query()
     async def get_store_floors(self, store_id: int) -> list[int]:
         """Get distinct floors for a store"""
         query = f"""
@@ -44,13 +242,37 @@ class BigQueryService:
             ]
         )
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
+            results = await self.run_query(query, job_config=job_config, label="get_store_floors")
             return [row.floor for row in results]
         except Exception as e:
             logger.error(f"Error fetching floors: {e}")
             raise
 
+    @cached_query()
+    async def get_floors_for_stores(self, store_ids: list[int]) -> dict[int, list[int]]:
+        """Get distinct floors for several stores in one query"""
+        query = f"""
+        SELECT store_id, floor
+        FROM `{self.table_id}`
+        WHERE store_id IN UNNEST(@store_ids)
+        GROUP BY store_id, floor
+        ORDER BY store_id, floor
+        """
+        job_config = QueryJobConfig(
+            query_parameters=[
+                ArrayQueryParameter("store_ids", "INT64", store_ids)
+            ]
+        )
+        try:
+            results = await self.run_query(query, job_config=job_config, label="get_floors_for_stores")
+            floors = {store_id: [] for store_id in store_ids}
+            for row in results:
+                floors[row.store_id].append(row.floor)
+            return floors
+        except Exception as e:
+            logger.error(f"Error fetching floors: {e}")
+            raise
+
     async def get_heatmap_data(
         self,
         store_id: int,
@@ -59,65 +281,55 @@ class BigQueryService:
         end_date: date,
         start_hour: int,
         end_hour: int,
-        grid_size: float
+        grid_size: float,
+        exact: bool = False,
+        layout: str = "rows"
     ) -> dict:
-        """Get aggregated heatmap data using grid binning"""
-        query = f"""
-        WITH grid_data AS (
-            SELECT
-                FLOOR(latitude / @grid_size) * @grid_size + (@grid_size / 2) as x,
-                FLOOR(longitude / @grid_size) * @grid_size + (@grid_size / 2) as y,
-                COUNT(*) as track_count,
-                COUNT(DISTINCT hash_id) as unique_visitors
-            FROM `{self.table_id}`
-            WHERE store_id = @store_id
-                AND floor = @floor
-                AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-            GROUP BY x, y
-        ),
-        bounds AS (
-            SELECT
-                MIN(latitude) as min_x,
-                MAX(latitude) as max_x,
-                MIN(longitude) as min_y,
-                MAX(longitude) as max_y,
-                SUM(track_count) as total_tracks,
-                SUM(unique_visitors) as total_visitors
-            FROM grid_data
-            CROSS JOIN (
-                SELECT latitude, longitude
-                FROM `{self.table_id}`
-                WHERE store_id = @store_id AND floor = @floor
-            )
-        )
-        SELECT
-            x, y, track_count, unique_visitors
-        FROM grid_data
-        ORDER BY track_count DESC
-        """
+        """Get aggregated heatmap data using grid binning.
 
+        Unique visitor counts are estimates unless exact=True. With layout="columns"
+        cells is {column: array} instead of a list of dicts (ORJSONResponse encodes
+        the arrays natively).
+        """
         # Convert grid_size from meters to degrees
         # At latitude ~55: 1 degree lat ≈ 111km, 1 degree lon ≈ 62km
         # cos(55.5°) ≈ 0.566
-        simple_query = f"""
+        # The floor-wide visitor count is taken over the same filtered rows and
+        # repeated on every cell row
+        query = f"""
         WITH params AS (
             SELECT
                 @grid_size / 111000.0 as lat_grid,
                 @grid_size / (111000.0 * 0.566) as lon_grid
+        ),
+        filtered AS (
+            SELECT
+                FLOOR(latitude / p.lat_grid) * p.lat_grid + (p.lat_grid / 2) as x,
+                FLOOR(longitude / p.lon_grid) * p.lon_grid + (p.lon_grid / 2) as y,
+                hash_id
+            FROM `{self.table_id}`, params p
+            WHERE store_id = @store_id
+                AND floor = @floor
+                AND date BETWEEN @start_date AND @end_date
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
+        ),
+        cells AS (
+            SELECT
+                x,
+                y,
+                COUNT(*) as track_count,
+                {count_distinct("hash_id", exact)} as unique_visitors
+            FROM filtered
+            GROUP BY x, y
+        ),
+        total AS (
+            SELECT {count_distinct("hash_id", exact)} as total_unique_visitors
+            FROM filtered
         )
-        SELECT
-            FLOOR(latitude / p.lat_grid) * p.lat_grid + (p.lat_grid / 2) as x,
-            FLOOR(longitude / p.lon_grid) * p.lon_grid + (p.lon_grid / 2) as y,
-            COUNT(*) as track_count,
-            COUNT(DISTINCT hash_id) as unique_visitors
-        FROM `{self.table_id}`, params p
-        WHERE store_id = @store_id
-            AND floor = @floor
-            AND date BETWEEN @start_date AND @end_date
-            AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-        GROUP BY x, y
-        ORDER BY track_count DESC
+        SELECT c.x, c.y, c.track_count, c.unique_visitors, t.total_unique_visitors
+        FROM cells c
+        CROSS JOIN total t
+        ORDER BY c.track_count DESC
         """
 
         job_config = QueryJobConfig(
@@ -133,45 +345,39 @@ class BigQueryService:
         )
 
         try:
-            query_job = self.client.query(simple_query, job_config=job_config)
-            results = list(query_job.result())
-
-            cells = []
-            min_x, max_x = float('inf'), float('-inf')
-            min_y, max_y = float('inf'), float('-inf')
-            total_tracks = 0
-            unique_visitors_set = set()
-
-            for row in results:
-                cells.append({
-                    "x": row.x,
-                    "y": row.y,
-                    "track_count": row.track_count,
-                    "unique_visitors": row.unique_visitors
-                })
-                min_x = min(min_x, row.x)
-                max_x = max(max_x, row.x)
-                min_y = min(min_y, row.y)
-                max_y = max(max_y, row.y)
-                total_tracks += row.track_count
+            table = await self.run_query_arrow(query, job_config=job_config, label="get_heatmap_data")
+        except Exception as e:
+            logger.error(f"Error fetching heatmap data: {e}")
+            raise
 
+        if not table.num_rows:
             return {
-                "cells": cells,
+                "cells": columns_or_rows(table.select(["x", "y", "track_count", "unique_visitors"]), layout),
                 "grid_size": grid_size,
-                "bounds": {
-                    "min_x": min_x if cells else 0,
-                    "max_x": max_x if cells else 0,
-                    "min_y": min_y if cells else 0,
-                    "max_y": max_y if cells else 0
-                },
-                "total_tracks": total_tracks,
-                "total_unique_visitors": len(set(c["unique_visitors"] for c in cells)) if cells else 0
+                "bounds": {"min_x": 0, "max_x": 0, "min_y": 0, "max_y": 0},
+                "total_tracks": 0,
+                "total_unique_visitors": 0
             }
-        except Exception as e:
-            logger.error(f"Error fetching heatmap data: {e}")
-            raise
 
-    async def get_raw_tracks(
+        x = table.column("x").to_numpy()
+        y = table.column("y").to_numpy()
+        track_count = table.column("track_count").to_numpy()
+
+        cells = table.select(["x", "y", "track_count", "unique_visitors"])
+        return {
+            "cells": columns_or_rows(cells, layout),
+            "grid_size": grid_size,
+            "bounds": {
+                "min_x": float(x.min()),
+                "max_x": float(x.max()),
+                "min_y": float(y.min()),
+                "max_y": float(y.max())
+            },
+            "total_tracks": int(track_count.sum()),
+            "total_unique_visitors": table.column("total_unique_visitors")[0].as_py()
+        }
+
+    def _raw_tracks_query(
         self,
         store_id: int,
         floor: int,
@@ -179,24 +385,60 @@ class BigQueryService:
         end_date: date,
         start_hour: int,
         end_hour: int,
-        max_points: int = 200000
-    ) -> tuple[list[dict], int]:
-        """Get raw track points with random sampling for large datasets.
+        max_points: int,
+        columns: tuple[str, ...]
+    ) -> tuple[str, QueryJobConfig]:
+        """Build the query for the matching points, sampled down to at most max_points.
 
-        Args:
-            max_points: Maximum points to return. Uses random sampling if data exceeds this.
+        The total number of matching points is counted in the same query and returned
+        as one extra row whose point columns are NULL; total_count is NULL on every
+        other row (see _split_total_count).
 
         Returns:
-            Tuple of (points list, total_count in database)
+            Tuple of (query, job_config)
         """
-        # First, get the total count
-        count_query = f"""
-        SELECT COUNT(*) as total
-        FROM `{self.table_id}`
-        WHERE store_id = @store_id
-            AND floor = @floor
-            AND date BETWEEN @start_date AND @end_date
-            AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
+        # Sampling works on hash_id, so it is read even if the caller does not need it
+        filtered_columns = columns if "hash_id" in columns else ("hash_id", *columns)
+
+        # Sample whole visitors so tracks stay intact (dwell needs consecutive points):
+        # visitors in fingerprint order while the running point count stays within
+        # max_points, so the same request always returns the same sample. A visitor with
+        # more points than max_points alone (e.g. a staff device) is skipped rather than
+        # ending the sample. Below max_points every visitor is kept.
+        query = f"""
+        WITH filtered AS (
+            SELECT {", ".join(filtered_columns)}
+            FROM `{self.table_id}`
+            WHERE store_id = @store_id
+                AND floor = @floor
+                AND date BETWEEN @start_date AND @end_date
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
+        ),
+        visitors AS (
+            SELECT hash_id, COUNT(*) as points
+            FROM filtered
+            GROUP BY hash_id
+        ),
+        kept AS (
+            SELECT hash_id
+            FROM (
+                SELECT
+                    hash_id,
+                    SUM(points) OVER (
+                        ORDER BY FARM_FINGERPRINT(CAST(hash_id AS STRING)), hash_id
+                        ROWS UNBOUNDED PRECEDING
+                    ) as running_points
+                FROM visitors
+                WHERE points <= @max_points
+            )
+            WHERE running_points <= @max_points
+        )
+        SELECT {", ".join(f"f.{c}" for c in columns)}, NULL as total_count
+        FROM filtered f
+        JOIN kept k ON f.hash_id = k.hash_id
+        UNION ALL
+        SELECT {", ".join("NULL" for _ in columns)}, IFNULL(SUM(points), 0)
+        FROM visitors
         """
 
         job_config = QueryJobConfig(
@@ -207,78 +449,214 @@ class BigQueryService:
                 ScalarQueryParameter("end_date", "DATE", end_date),
                 ScalarQueryParameter("start_hour", "INT64", start_hour),
                 ScalarQueryParameter("end_hour", "INT64", end_hour),
+                ScalarQueryParameter("max_points", "INT64", max_points),
             ]
         )
 
-        count_job = self.client.query(count_query, job_config=job_config)
-        total_count = list(count_job.result())[0].total
+        return query, job_config
 
-        # Calculate sampling rate if needed
-        if total_count > max_points:
-            sample_rate = max_points / total_count
-            # Use random sampling
-            query = f"""
+    @staticmethod
+    def _split_total_count(batch: pa.RecordBatch) -> tuple[pa.RecordBatch, Optional[int]]:
+        """Separate the raw tracks total row from the points in a batch.
+
+        Returns the batch without that row and the total, or the batch unchanged and
+        None if the row is in another batch.
+        """
+        total = batch.column("total_count")
+        if total.null_count == batch.num_rows:
+            return batch, None
+        return batch.filter(total.is_null()), pc.max(total).as_py()
+
+    async def get_raw_tracks(
+        self,
+        store_id: int,
+        floor: int,
+        start_date: date,
+        end_date: date,
+        start_hour: int,
+        end_hour: int,
+        max_points: int = 200000,
+        columns: tuple[str, ...] = RAW_TRACK_COLUMNS
+    ) -> tuple[list[dict], int]:
+        """Get raw track points with random sampling for large datasets.
+
+        Args:
+            max_points: Maximum points to return. Whole visitors are sampled if data exceeds this.
+            columns: Columns to select. BigQuery bills per column read, so callers
+                that need fewer should say so.
+
+        Returns:
+            Tuple of (points list, total_count in database)
+        """
+        query, job_config = self._raw_tracks_query(
+            store_id, floor, start_date, end_date, start_hour, end_hour, max_points, columns
+        )
+
+        def read(batches: Iterable[pa.RecordBatch], total_rows: int) -> tuple[list[dict], int]:
+            points, total_count = [], 0
+            for batch in batches:
+                batch, batch_total = self._split_total_count(batch)
+                if batch_total is not None:
+                    total_count = batch_total
+                points.extend(batch.select(columns).to_pylist())
+            return points, total_count
+
+        try:
+            return await self.run_query_batches(query, read, job_config, label="get_raw_tracks")
+        except Exception as e:
+            logger.error(f"Error fetching raw tracks: {e}")
+            raise
+
+    async def get_raw_track_arrays(
+        self,
+        store_id: int,
+        floor: int,
+        start_date: date,
+        end_date: date,
+        start_hour: int,
+        end_hour: int,
+        max_points: int = 200000,
+        columns: tuple[str, ...] = ("longitude", "latitude")
+    ) -> tuple[dict[str, np.ndarray], int]:
+        """Same points as get_raw_tracks, decoded into one array per column.
+
+        Numeric columns come back as float64 arrays, sized from the result's row count
+        and filled batch by batch. hash_id comes back as int64 visitor codes numbering
+        the distinct ids in order of first appearance. No dict is built per row and
+        only the requested columns are read.
+
+        Returns:
+            Tuple of ({column: array}, total_count in database)
+        """
+        query, job_config = self._raw_tracks_query(
+            store_id, floor, start_date, end_date, start_hour, end_hour, max_points, columns
+        )
+
+        def read(batches: Iterable[pa.RecordBatch], total_rows: int) -> tuple[dict[str, np.ndarray], int]:
+            numeric = [name for name in columns if name != "hash_id"]
+            arrays = {name: np.empty(total_rows, dtype=np.float64) for name in numeric}
+            hash_ids = []
+            filled, total_count = 0, 0
+            for batch in batches:
+                batch, batch_total = self._split_total_count(batch)
+                if batch_total is not None:
+                    total_count = batch_total
+                if not batch.num_rows:
+                    continue
+                end = filled + batch.num_rows
+                for name in numeric:
+                    arrays[name][filled:end] = batch.column(name).to_numpy()
+                if "hash_id" in columns:
+                    hash_ids.append(batch.column("hash_id"))
+                filled = end
+            arrays = {name: array[:filled] for name, array in arrays.items()}
+            if "hash_id" in columns:
+                arrays["hash_id"] = (
+                    pa.concat_arrays(hash_ids).dictionary_encode().indices.to_numpy().astype(np.int64)
+                    if hash_ids else np.empty(0, dtype=np.int64)
+                )
+            return arrays, total_count
+
+        try:
+            return await self.run_query_batches(query, read, job_config, label="get_raw_track_arrays")
+        except Exception as e:
+            logger.error(f"Error fetching raw tracks: {e}")
+            raise
+
+    async def get_dwell_events(
+        self,
+        store_id: int,
+        floor: int,
+        start_date: date,
+        end_date: date,
+        start_hour: int,
+        end_hour: int,
+        spatial_threshold: float,
+        min_dwell_seconds: int
+    ) -> dict[str, np.ndarray]:
+        """Find stationary periods over all matching points in BigQuery.
+
+        A visitor's period ends where the next point is more than spatial_threshold
+        meters from the previous one; that split is a window function, unlike the
+        running-centroid rule of DwellTimeService, so periods can be somewhat longer.
+        Only periods lasting at least min_dwell_seconds are returned.
+
+        Returns:
+            {column: array} with hash_id as int64 visitor codes (as in
+            get_raw_track_arrays), x (longitude), y (latitude), start_time, end_time
+        """
+        # At latitude ~55.5: 1 degree lat ≈ 111km, 1 degree lon ≈ 62km (cos(55.5°) ≈ 0.566)
+        query = f"""
+        WITH points AS (
             SELECT
                 hash_id,
+                timestamp,
                 latitude,
                 longitude,
-                timestamp,
-                floor,
-                uncertainty
+                LAG(latitude) OVER visitor_track as prev_latitude,
+                LAG(longitude) OVER visitor_track as prev_longitude,
+                COUNT(*) OVER (PARTITION BY hash_id) as visitor_points
             FROM `{self.table_id}`
             WHERE store_id = @store_id
                 AND floor = @floor
                 AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-                AND RAND() < @sample_rate
-            """
-            job_config = QueryJobConfig(
-                query_parameters=[
-                    ScalarQueryParameter("store_id", "INT64", store_id),
-                    ScalarQueryParameter("floor", "INT64", floor),
-                    ScalarQueryParameter("start_date", "DATE", start_date),
-                    ScalarQueryParameter("end_date", "DATE", end_date),
-                    ScalarQueryParameter("start_hour", "INT64", start_hour),
-                    ScalarQueryParameter("end_hour", "INT64", end_hour),
-                    ScalarQueryParameter("sample_rate", "FLOAT64", sample_rate * 1.1),  # slightly over to ensure enough
-                ]
-            )
-        else:
-            # Fetch all data
-            query = f"""
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
+            WINDOW visitor_track AS (PARTITION BY hash_id ORDER BY timestamp)
+        ),
+        periods AS (
             SELECT
                 hash_id,
+                timestamp,
                 latitude,
                 longitude,
-                timestamp,
-                floor,
-                uncertainty
-            FROM `{self.table_id}`
-            WHERE store_id = @store_id
-                AND floor = @floor
-                AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-            """
+                visitor_points,
+                COUNTIF(
+                    prev_latitude IS NULL
+                    OR POW((latitude - prev_latitude) * 111000, 2)
+                        + POW((longitude - prev_longitude) * 111000 * 0.566, 2) > POW(@threshold, 2)
+                ) OVER (PARTITION BY hash_id ORDER BY timestamp ROWS UNBOUNDED PRECEDING) as period
+            FROM points
+        )
+        SELECT
+            hash_id,
+            AVG(longitude) as x,
+            AVG(latitude) as y,
+            MIN(timestamp) as start_time,
+            MAX(timestamp) as end_time
+        FROM periods
+        WHERE visitor_points >= 2
+        GROUP BY hash_id, period
+        HAVING MAX(timestamp) - MIN(timestamp) >= @min_dwell
+        ORDER BY hash_id, start_time
+        """
 
-        try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
-            points = [
-                {
-                    "hash_id": row.hash_id,
-                    "latitude": row.latitude,
-                    "longitude": row.longitude,
-                    "timestamp": row.timestamp,
-                    "floor": row.floor,
-                    "uncertainty": row.uncertainty
-                }
-                for row in results
+        job_config = QueryJobConfig(
+            query_parameters=[
+                ScalarQueryParameter("store_id", "INT64", store_id),
+                ScalarQueryParameter("floor", "INT64", floor),
+                ScalarQueryParameter("start_date", "DATE", start_date),
+                ScalarQueryParameter("end_date", "DATE", end_date),
+                ScalarQueryParameter("start_hour", "INT64", start_hour),
+                ScalarQueryParameter("end_hour", "INT64", end_hour),
+                ScalarQueryParameter("threshold", "FLOAT64", spatial_threshold),
+                ScalarQueryParameter("min_dwell", "INT64", min_dwell_seconds),
             ]
-            return points, total_count
+        )
+
+        try:
+            table = await self.run_query_arrow(query, job_config=job_config, label="get_dwell_events")
         except Exception as e:
-            logger.error(f"Error fetching raw tracks: {e}")
+            logger.error(f"Error fetching dwell events: {e}")
             raise
 
+        return {
+            "hash_id": table.column("hash_id").dictionary_encode().combine_chunks().indices.to_numpy().astype(np.int64),
+            "x": table.column("x").to_numpy(),
+            "y": table.column("y").to_numpy(),
+            "start_time": table.column("start_time").to_numpy(),
+            "end_time": table.column("end_time").to_numpy()
+        }
+
     async def get_aggregated_heatmap(
         self,
         store_id: int,
@@ -287,8 +665,10 @@ class BigQueryService:
         end_date: date,
         start_hour: int,
         end_hour: int,
-        bin_size: float = 0.000005  # ~0.5 meters in lat/lon for finer resolution
-    ) -> tuple[list[dict], int]:
+        bin_size: float = 0.000005,  # ~0.5 meters in lat/lon for finer resolution
+        exact: bool = False,
+        layout: str = "rows"
+    ) -> tuple[list[dict] | dict[str, np.ndarray], int]:
         """Get aggregated heatmap data with spatial binning.
 
         Aggregates all points into spatial bins for accurate density visualization.
@@ -296,22 +676,24 @@ class BigQueryService:
 
         Args:
             bin_size: Size of spatial bins in degrees (~0.000025 = 2.75 meters)
+            exact: Count unique visitors per bin exactly instead of estimating them.
+            layout: "rows" for a list of bin dicts, "columns" for {column: array}.
 
         Returns:
-            Tuple of (bins list with counts, total_point_count)
+            Tuple of (bins with counts, total_point_count)
         """
         query = f"""
         SELECT
-            ROUND(longitude / @bin_size) * @bin_size as bin_x,
-            ROUND(latitude / @bin_size) * @bin_size as bin_y,
+            ROUND(longitude / @bin_size) * @bin_size as x,
+            ROUND(latitude / @bin_size) * @bin_size as y,
             COUNT(*) as count,
-            COUNT(DISTINCT hash_id) as unique_visitors
+            {count_distinct("hash_id", exact)} as unique_visitors
         FROM `{self.table_id}`
         WHERE store_id = @store_id
             AND floor = @floor
             AND date BETWEEN @start_date AND @end_date
-            AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-        GROUP BY bin_x, bin_y
+            AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
+        GROUP BY x, y
         """
 
         job_config = QueryJobConfig(
@@ -327,25 +709,15 @@ class BigQueryService:
         )
 
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
-
-            bins = []
-            total_points = 0
-            for row in results:
-                bins.append({
-                    "x": row.bin_x,
-                    "y": row.bin_y,
-                    "count": row.count,
-                    "unique_visitors": row.unique_visitors
-                })
-                total_points += row.count
-
-            return bins, total_points
+            table = await self.run_query_arrow(query, job_config=job_config, label="get_aggregated_heatmap")
+            total_points = int(np.sum(table.column("count").to_numpy()))
+            return columns_or_rows(table, layout), total_points
         except Exception as e:
             logger.error(f"Error fetching aggregated heatmap: {e}")
             raise
 
+    # Failed lookups come back as per-zone error entries; those are not kept
+    @cached_query(cache_if=lambda stats: not any("error" in stat for stat in stats))
     async def get_zone_stats(
         self,
         store_id: int,
@@ -356,77 +728,128 @@ class BigQueryService:
         start_hour: int,
         end_hour: int,
         offset_x: float = 0.0,  # Coordinate offset to subtract (x = longitude)
-        offset_y: float = 0.0   # Coordinate offset to subtract (y = latitude)
+        offset_y: float = 0.0,  # Coordinate offset to subtract (y = latitude)
+        exact: bool = False
     ) -> list[dict]:
         """Get visitor counts for specified zones.
 
         Zone coordinates are in data space (x=longitude+offset, y=latitude+offset).
         We need to subtract the offset to query raw lat/lon in BigQuery.
         Note: x corresponds to longitude, y corresponds to latitude.
+        Visitor counts are estimates unless exact=True; estimates come from the hourly
+        rollup when one is configured.
         """
-        results = []
+        if not zones:
+            return []
 
-        for zone in zones:
-            # Zone coords are in data space with offset applied
-            # Subtract offset to get raw lat/lon for BigQuery
-            # x = longitude, y = latitude
-            lon_min = min(zone["x1"], zone["x2"]) - offset_x
-            lon_max = max(zone["x1"], zone["x2"]) - offset_x
-            lat_min = min(zone["y1"], zone["y2"]) - offset_y
-            lat_max = max(zone["y1"], zone["y2"]) - offset_y
+        # One scan for all zones; the rectangles are passed as parallel array parameters
+        if self.rollup_table_id and not exact:
+            # Rollup bins count towards a zone when their centre lies inside it;
+            # day sketches give visitor-days, merged sketches give unique visitors
+            query = f"""
+            WITH zones AS ({ZONES_SQL}            ),
+            zone_days AS (
+                SELECT
+                    z.zone_idx,
+                    r.date,
+                    SUM(r.track_count) as track_count,
+                    HLL_COUNT.MERGE_PARTIAL(r.visitors) as visitors
+                FROM `{self.rollup_table_id}` r
+                JOIN zones z
+                    ON r.bin_x BETWEEN z.lon_min AND z.lon_max
+                    AND r.bin_y BETWEEN z.lat_min AND z.lat_max
+                WHERE r.store_id = @store_id
+                    AND r.floor = @floor
+                    AND r.date BETWEEN @start_date AND @end_date
+                    AND r.hour BETWEEN @start_hour AND @end_hour
+                GROUP BY z.zone_idx, r.date
+            )
+            SELECT
+                zone_idx,
+                SUM(track_count) as track_count,
+                HLL_COUNT.MERGE(visitors) as unique_visitors,
+                SUM(HLL_COUNT.EXTRACT(visitors)) as visitor_days
+            FROM zone_days
+            GROUP BY zone_idx
+            """
+        else:
+            # Conditional aggregates per zone over the raw rows: one result row,
+            # no join and no GROUP BY
+            zone_columns = []
+            for i in range(len(zones)):
+                in_zone = in_zone_sql(i)
+                visitor = f"IF({in_zone}, hash_id, NULL)"
+                visitor_day = f"IF({in_zone}, CONCAT(hash_id, '-', CAST(date AS STRING)), NULL)"
+                zone_columns.append(
+                    f"COUNTIF({in_zone}) as zone_{i}_tracks,\n"
+                    f"                {count_distinct(visitor, exact)} as zone_{i}_visitors,\n"
+                    f"                {count_distinct(visitor_day, exact)} as zone_{i}_days"
+                )
+            zone_columns = ",\n                ".join(zone_columns)
 
             query = f"""
             SELECT
-                COUNT(*) as track_count,
-                COUNT(DISTINCT hash_id) as unique_visitors,
-                COUNT(DISTINCT CONCAT(hash_id, '-', CAST(date AS STRING))) as visitor_days
+                {zone_columns}
             FROM `{self.table_id}`
             WHERE store_id = @store_id
                 AND floor = @floor
                 AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-                AND longitude BETWEEN @lon_min AND @lon_max
-                AND latitude BETWEEN @lat_min AND @lat_max
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
             """
 
-            job_config = QueryJobConfig(
-                query_parameters=[
-                    ScalarQueryParameter("store_id", "INT64", store_id),
-                    ScalarQueryParameter("floor", "INT64", floor),
-                    ScalarQueryParameter("start_date", "DATE", start_date),
-                    ScalarQueryParameter("end_date", "DATE", end_date),
-                    ScalarQueryParameter("start_hour", "INT64", start_hour),
-                    ScalarQueryParameter("end_hour", "INT64", end_hour),
-                    ScalarQueryParameter("lon_min", "FLOAT64", lon_min),
-                    ScalarQueryParameter("lon_max", "FLOAT64", lon_max),
-                    ScalarQueryParameter("lat_min", "FLOAT64", lat_min),
-                    ScalarQueryParameter("lat_max", "FLOAT64", lat_max),
-                ]
-            )
+        job_config = QueryJobConfig(
+            query_parameters=[
+                ScalarQueryParameter("store_id", "INT64", store_id),
+                ScalarQueryParameter("floor", "INT64", floor),
+                ScalarQueryParameter("start_date", "DATE", start_date),
+                ScalarQueryParameter("end_date", "DATE", end_date),
+                ScalarQueryParameter("start_hour", "INT64", start_hour),
+                ScalarQueryParameter("end_hour", "INT64", end_hour),
+                *zone_bounds_params(zones, offset_x, offset_y),
+            ]
+        )
 
-            try:
-                query_job = self.client.query(query, job_config=job_config)
-                row = list(query_job.result())[0]
-                results.append({
-                    "zone_id": zone["id"],
-                    "zone_name": zone.get("name", f"Zone {zone['id']}"),
-                    "track_count": row.track_count,
-                    "unique_visitors": row.unique_visitors,
-                    "visitor_days": row.visitor_days  # Accumulated visits (same person on different days counts multiple times)
-                })
-            except Exception as e:
-                logger.error(f"Error fetching zone stats for zone {zone['id']}: {e}")
-                results.append({
+        try:
+            rows = await self.run_query(query, job_config=job_config, label="get_zone_stats")
+        except Exception as e:
+            logger.error(f"Error fetching zone stats for zones {[z['id'] for z in zones]}: {e}")
+            return [
+                {
                     "zone_id": zone["id"],
                     "zone_name": zone.get("name", f"Zone {zone['id']}"),
                     "track_count": 0,
                     "unique_visitors": 0,
                     "visitor_days": 0,
                     "error": str(e)
-                })
+                }
+                for zone in zones
+            ]
+
+        # (track_count, unique_visitors, visitor_days) per zone position
+        if self.rollup_table_id and not exact:
+            counts = {row.zone_idx: (row.track_count, row.unique_visitors, row.visitor_days) for row in rows}
+        else:
+            row = rows[0]
+            counts = {
+                i: (row[f"zone_{i}_tracks"], row[f"zone_{i}_visitors"], row[f"zone_{i}_days"])
+                for i in range(len(zones))
+            }
+
+        results = []
+        for i, zone in enumerate(zones):
+            # Rollup zones without any matching bins have no row
+            track_count, unique_visitors, visitor_days = counts.get(i, (0, 0, 0))
+            results.append({
+                "zone_id": zone["id"],
+                "zone_name": zone.get("name", f"Zone {zone['id']}"),
+                "track_count": track_count,
+                "unique_visitors": unique_visitors,
+                "visitor_days": visitor_days  # Accumulated visits (same person on different days counts multiple times)
+            })
 
         return results
 
+    @cached_query()
     async def get_visitors_outside_zones(
         self,
         store_id: int,
@@ -437,46 +860,30 @@ class BigQueryService:
         start_hour: int,
         end_hour: int,
         offset_x: float = 0.0,
-        offset_y: float = 0.0
+        offset_y: float = 0.0,
+        exact: bool = False
     ) -> dict:
-        """Get unique visitors that are NOT in any of the specified zones."""
-
-        # Build zone exclusion conditions
-        zone_conditions = []
-        for zone in zones:
-            lon_min = min(zone["x1"], zone["x2"]) - offset_x
-            lon_max = max(zone["x1"], zone["x2"]) - offset_x
-            lat_min = min(zone["y1"], zone["y2"]) - offset_y
-            lat_max = max(zone["y1"], zone["y2"]) - offset_y
-            zone_conditions.append(
-                f"(longitude BETWEEN {lon_min} AND {lon_max} AND latitude BETWEEN {lat_min} AND {lat_max})"
-            )
+        """Get unique visitors that are NOT in any of the specified zones.
 
-        # Visitors in ANY zone
-        in_zones_condition = " OR ".join(zone_conditions) if zone_conditions else "FALSE"
+        Every visitor seen in a zone is also in the floor total, so the outside count is
+        their difference; both come from one scan. Counts are estimates unless exact=True.
+        """
+        # Visitors in ANY zone: walk the zone arrays, so the query text never changes
+        in_zones_condition = """EXISTS(
+                SELECT 1 FROM UNNEST(@lon_min) AS zone_lon_min WITH OFFSET zone_idx
+                WHERE longitude BETWEEN zone_lon_min AND @lon_max[OFFSET(zone_idx)]
+                    AND latitude BETWEEN @lat_min[OFFSET(zone_idx)] AND @lat_max[OFFSET(zone_idx)]
+            )"""
 
         query = f"""
-        WITH all_visitors AS (
-            SELECT DISTINCT hash_id
-            FROM `{self.table_id}`
-            WHERE store_id = @store_id
-                AND floor = @floor
-                AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-        ),
-        visitors_in_zones AS (
-            SELECT DISTINCT hash_id
-            FROM `{self.table_id}`
-            WHERE store_id = @store_id
-                AND floor = @floor
-                AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
-                AND ({in_zones_condition})
-        )
         SELECT
-            (SELECT COUNT(*) FROM all_visitors) as total_visitors,
-            (SELECT COUNT(*) FROM visitors_in_zones) as visitors_in_zones,
-            (SELECT COUNT(*) FROM all_visitors WHERE hash_id NOT IN (SELECT hash_id FROM visitors_in_zones)) as visitors_outside_zones
+            {count_distinct("hash_id", exact)} as total_visitors,
+            {count_distinct(f"IF({in_zones_condition}, hash_id, NULL)", exact)} as visitors_in_zones
+        FROM `{self.table_id}`
+        WHERE store_id = @store_id
+            AND floor = @floor
+            AND date BETWEEN @start_date AND @end_date
+            AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
         """
 
         job_config = QueryJobConfig(
@@ -487,21 +894,24 @@ class BigQueryService:
                 ScalarQueryParameter("end_date", "DATE", end_date),
                 ScalarQueryParameter("start_hour", "INT64", start_hour),
                 ScalarQueryParameter("end_hour", "INT64", end_hour),
+                *zone_bounds_params(zones, offset_x, offset_y),
             ]
         )
 
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            row = list(query_job.result())[0]
+            row = await self.run_query_one(query, job_config=job_config, label="get_visitors_outside_zones")
+            # Independent estimates can cross; a subset never outnumbers its whole
+            visitors_in_zones = min(row.visitors_in_zones, row.total_visitors)
             return {
                 "total_visitors": row.total_visitors,
-                "visitors_in_zones": row.visitors_in_zones,
-                "visitors_outside_zones": row.visitors_outside_zones
+                "visitors_in_zones": visitors_in_zones,
+                "visitors_outside_zones": row.total_visitors - visitors_in_zones
             }
         except Exception as e:
             logger.error(f"Error fetching visitors outside zones: {e}")
             raise
 
+    @cached_query()
     async def get_track_completeness(
         self,
         store_id: int,
@@ -520,16 +930,10 @@ class BigQueryService:
             return {"error": "No zones provided"}
 
         # Build a CASE statement to count zones per visitor
-        zone_cases = []
-        for i, zone in enumerate(zones):
-            lon_min = min(zone["x1"], zone["x2"]) - offset_x
-            lon_max = max(zone["x1"], zone["x2"]) - offset_x
-            lat_min = min(zone["y1"], zone["y2"]) - offset_y
-            lat_max = max(zone["y1"], zone["y2"]) - offset_y
-            zone_name = zone.get("name", f"Zone_{i}")
-            zone_cases.append(
-                f"MAX(CASE WHEN longitude BETWEEN {lon_min} AND {lon_max} AND latitude BETWEEN {lat_min} AND {lat_max} THEN 1 ELSE 0 END) as zone_{i}"
-            )
+        zone_cases = [
+            f"MAX(CASE WHEN {in_zone_sql(i)} THEN 1 ELSE 0 END) as zone_{i}"
+            for i in range(len(zones))
+        ]
 
         zone_columns = ", ".join(zone_cases)
         zone_sum = " + ".join([f"zone_{i}" for i in range(len(zones))])
@@ -543,7 +947,7 @@ class BigQueryService:
             WHERE store_id = @store_id
                 AND floor = @floor
                 AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
             GROUP BY hash_id
         ),
         visitor_zone_counts AS (
@@ -568,12 +972,12 @@ class BigQueryService:
                 ScalarQueryParameter("end_date", "DATE", end_date),
                 ScalarQueryParameter("start_hour", "INT64", start_hour),
                 ScalarQueryParameter("end_hour", "INT64", end_hour),
+                *zone_bounds_params(zones, offset_x, offset_y),
             ]
         )
 
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            results = list(query_job.result())
+            results = await self.run_query(query, job_config=job_config, label="get_track_completeness")
 
             distribution = {row.zones_visited: row.visitor_count for row in results}
             total_visitors = sum(distribution.values())
@@ -609,63 +1013,87 @@ class BigQueryService:
         offset_x: float = 0.0,
         offset_y: float = 0.0
     ) -> dict:
+        """Analyze track quality for a single zone (see get_zones_track_quality)."""
+        results = await self.get_zones_track_quality(
+            store_id, floor, [zone], start_date, end_date, start_hour, end_hour, offset_x, offset_y
+        )
+        return results[0]
+
+    @cached_query()
+    async def get_zones_track_quality(
+        self,
+        store_id: int,
+        floor: int,
+        zones: list[dict],
+        start_date: date,
+        end_date: date,
+        start_hour: int,
+        end_hour: int,
+        offset_x: float = 0.0,
+        offset_y: float = 0.0
+    ) -> list[dict]:
         """
-        Analyze track quality for a single zone.
+        Analyze track quality for each zone, with one scan for all zones.
         Detects incomplete tracks: those that start or end inside the zone
         without entering/exiting properly.
         """
-        lon_min = min(zone["x1"], zone["x2"]) - offset_x
-        lon_max = max(zone["x1"], zone["x2"]) - offset_x
-        lat_min = min(zone["y1"], zone["y2"]) - offset_y
-        lat_max = max(zone["y1"], zone["y2"]) - offset_y
+        if not zones:
+            return []
 
         query = f"""
-        WITH visitor_positions AS (
+        WITH positions AS (
             SELECT
                 hash_id,
                 timestamp,
                 longitude,
-                latitude,
-                CASE
-                    WHEN longitude BETWEEN {lon_min} AND {lon_max}
-                     AND latitude BETWEEN {lat_min} AND {lat_max}
-                    THEN 1 ELSE 0
-                END as in_zone
+                latitude
             FROM `{self.table_id}`
             WHERE store_id = @store_id
                 AND floor = @floor
                 AND date BETWEEN @start_date AND @end_date
-                AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
         ),
-        visitor_summary AS (
+        zones AS ({ZONES_SQL}        ),
+        visitor_times AS (
             SELECT
                 hash_id,
                 MIN(timestamp) as first_pos_time,
-                MAX(timestamp) as last_pos_time,
-                MIN(CASE WHEN in_zone = 1 THEN timestamp END) as first_in_zone,
-                MAX(CASE WHEN in_zone = 1 THEN timestamp END) as last_in_zone,
-                MAX(in_zone) as was_in_zone,
-                -- Check if they have positions before entering zone
-                MAX(CASE WHEN in_zone = 0 AND timestamp < (
-                    SELECT MIN(t2.timestamp) FROM visitor_positions t2
-                    WHERE t2.hash_id = visitor_positions.hash_id AND t2.in_zone = 1
-                ) THEN 1 ELSE 0 END) as has_entry,
-                -- Check if they have positions after leaving zone
-                MAX(CASE WHEN in_zone = 0 AND timestamp > (
-                    SELECT MAX(t2.timestamp) FROM visitor_positions t2
-                    WHERE t2.hash_id = visitor_positions.hash_id AND t2.in_zone = 1
-                ) THEN 1 ELSE 0 END) as has_exit
-            FROM visitor_positions
+                MAX(timestamp) as last_pos_time
+            FROM positions
             GROUP BY hash_id
-            HAVING was_in_zone = 1
+        ),
+        zone_times AS (
+            SELECT
+                z.zone_idx,
+                p.hash_id,
+                MIN(p.timestamp) as first_in_zone,
+                MAX(p.timestamp) as last_in_zone
+            FROM positions p
+            JOIN zones z
+                ON p.longitude BETWEEN z.lon_min AND z.lon_max
+                AND p.latitude BETWEEN z.lat_min AND z.lat_max
+            GROUP BY z.zone_idx, p.hash_id
+        ),
+        visitor_summary AS (
+            SELECT
+                zt.zone_idx,
+                -- Any position before the first one in the zone lies outside it,
+                -- so the visitor has an entry if their track starts earlier
+                IF(vt.first_pos_time < zt.first_in_zone, 1, 0) as has_entry,
+                -- Likewise an exit if the track ends after the last position in the zone
+                IF(vt.last_pos_time > zt.last_in_zone, 1, 0) as has_exit
+            FROM zone_times zt
+            JOIN visitor_times vt USING (hash_id)
         )
         SELECT
+            zone_idx,
             COUNT(*) as total_in_zone,
             SUM(CASE WHEN has_entry = 1 AND has_exit = 1 THEN 1 ELSE 0 END) as complete_tracks,
             SUM(CASE WHEN has_entry = 0 AND has_exit = 1 THEN 1 ELSE 0 END) as no_entry,
             SUM(CASE WHEN has_entry = 1 AND has_exit = 0 THEN 1 ELSE 0 END) as no_exit,
             SUM(CASE WHEN has_entry = 0 AND has_exit = 0 THEN 1 ELSE 0 END) as no_entry_no_exit
         FROM visitor_summary
+        GROUP BY zone_idx
         """
 
         job_config = QueryJobConfig(
@@ -676,31 +1104,39 @@ class BigQueryService:
                 ScalarQueryParameter("end_date", "DATE", end_date),
                 ScalarQueryParameter("start_hour", "INT64", start_hour),
                 ScalarQueryParameter("end_hour", "INT64", end_hour),
+                *zone_bounds_params(zones, offset_x, offset_y),
             ]
         )
 
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            row = list(query_job.result())[0]
+            rows = await self.run_query(query, job_config=job_config, label="get_zones_track_quality")
+        except Exception as e:
+            logger.error(f"Error fetching zone track quality: {e}")
+            raise
 
-            total = row.total_in_zone or 0
-            complete = row.complete_tracks or 0
+        # Zones nobody was seen in have no row
+        rows = {row.zone_idx: row for row in rows}
+        results = []
+        for i, zone in enumerate(zones):
+            row = rows.get(i)
+            total = row.total_in_zone if row else 0
+            complete = row.complete_tracks if row else 0
 
-            return {
+            results.append({
                 "zone_name": zone.get("name", "Unknown"),
                 "total_visitors": total,
                 "complete_tracks": complete,
                 "complete_pct": round(complete / total * 100, 1) if total > 0 else 0,
                 "incomplete_tracks": {
-                    "no_entry": row.no_entry or 0,  # Track starts inside zone
-                    "no_exit": row.no_exit or 0,    # Track ends inside zone
-                    "no_entry_no_exit": row.no_entry_no_exit or 0  # Only seen inside zone
+                    "no_entry": row.no_entry if row else 0,  # Track starts inside zone
+                    "no_exit": row.no_exit if row else 0,    # Track ends inside zone
+                    "no_entry_no_exit": row.no_entry_no_exit if row else 0  # Only seen inside zone
                 }
-            }
-        except Exception as e:
-            logger.error(f"Error fetching zone track quality: {e}")
-            raise
+            })
+
+        return results
 
+    @cached_query()
     async def get_floor_totals(
         self,
         store_id: int,
@@ -708,23 +1144,49 @@ class BigQueryService:
         start_date: date,
         end_date: date,
         start_hour: int,
-        end_hour: int
+        end_hour: int,
+        exact: bool = False
     ) -> dict:
         """Get total track count and unique visitors for entire floor.
 
-        Useful for diagnostics to compare against zone-filtered counts.
-        """
-        query = f"""
-        SELECT
-            COUNT(*) as total_tracks,
-            COUNT(DISTINCT hash_id) as unique_visitors,
-            COUNT(DISTINCT CONCAT(hash_id, '-', CAST(date AS STRING))) as visitor_days
-        FROM `{self.table_id}`
-        WHERE store_id = @store_id
-            AND floor = @floor
-            AND date BETWEEN @start_date AND @end_date
-            AND EXTRACT(HOUR FROM TIMESTAMP_SECONDS(timestamp)) BETWEEN @start_hour AND @end_hour
+        Useful for diagnostics to compare against zone-filtered counts. Visitor counts
+        are estimates unless exact=True; estimates come from the hourly rollup when
+        one is configured.
         """
+        if self.rollup_table_id and not exact:
+            # Per-day sketches: their sizes add up to visitor-days, their union is the
+            # unique visitor count
+            query = f"""
+            WITH days AS (
+                SELECT
+                    date,
+                    SUM(track_count) as track_count,
+                    HLL_COUNT.MERGE_PARTIAL(visitors) as visitors
+                FROM `{self.rollup_table_id}`
+                WHERE store_id = @store_id
+                    AND floor = @floor
+                    AND date BETWEEN @start_date AND @end_date
+                    AND hour BETWEEN @start_hour AND @end_hour
+                GROUP BY date
+            )
+            SELECT
+                IFNULL(SUM(track_count), 0) as total_tracks,
+                IFNULL(HLL_COUNT.MERGE(visitors), 0) as unique_visitors,
+                IFNULL(SUM(HLL_COUNT.EXTRACT(visitors)), 0) as visitor_days
+            FROM days
+            """
+        else:
+            query = f"""
+            SELECT
+                COUNT(*) as total_tracks,
+                {count_distinct("hash_id", exact)} as unique_visitors,
+                {count_distinct("CONCAT(hash_id, '-', CAST(date AS STRING))", exact)} as visitor_days
+            FROM `{self.table_id}`
+            WHERE store_id = @store_id
+                AND floor = @floor
+                AND date BETWEEN @start_date AND @end_date
+                AND {self.hour_expr} BETWEEN @start_hour AND @end_hour
+            """
 
         job_config = QueryJobConfig(
             query_parameters=[
@@ -738,8 +1200,7 @@ class BigQueryService:
         )
 
         try:
-            query_job = self.client.query(query, job_config=job_config)
-            row = list(query_job.result())[0]
+            row = await self.run_query_one(query, job_config, label="get_floor_totals")
             return {
                 "total_tracks": row.total_tracks,
                 "unique_visitors": row.unique_visitors,
@@ -753,7 +1214,7 @@ class BigQueryService:
         """Test BigQuery connection and return table info"""
         try:
             # Try to get table metadata
-            table = self.client.get_table(self.table_id)
+            table = await asyncio.to_thread(self.client.get_table, self.table_id)
             return {
                 "status": "connected",
                 "table": self.table_id,
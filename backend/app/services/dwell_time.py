@@ -1,31 +1,29 @@
+from bisect import bisect_left
 from datetime import date
-from typing import Optional
-from collections import defaultdict
-import math
-import aiosqlite
-import os
+from typing import NamedTuple, Optional
+import numpy as np
 
 from app.services.bigquery import BigQueryService
 from app.config import Settings
+from app.models.database import get_coordinate_offset
 
-# Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "tracking.db")
+# Flat-earth scale at the stores' latitude (~55.5): 1 degree lat ≈ 111km,
+# 1 degree lon ≈ 62km (cos(55.5°) ≈ 0.566)
+METERS_PER_DEG_LAT = 111000.0
+METERS_PER_DEG_LON = 111000.0 * 0.566
 
+# Cap dwell duration at 30 minutes (1800s) to filter out staff/outliers
+MAX_DWELL_SECONDS = 1800
 
-async def get_coordinate_offset(store_id: int, floor: int) -> tuple[float, float]:
-    """Get coordinate offset for a floor plan (to align tracking data with floor plan)."""
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT offset_x, offset_y FROM floorplans WHERE store_id = ? AND floor = ?",
-                (store_id, floor)
-            )
-            row = await cursor.fetchone()
-            if row and row[0] is not None and row[1] is not None:
-                return row[0], row[1]  # offset_x (longitude), offset_y (latitude)
-    except Exception:
-        pass
-    return 0.0, 0.0
+
+class DwellEvent(NamedTuple):
+    """A stationary period of one visitor. Built and consumed inside this service only."""
+    visitor: int  # index of the visitor's hash_id within one batch of tracks
+    x: float  # longitude (horizontal)
+    y: float  # latitude (vertical)
+    duration: int
+    start_time: int
+    end_time: int
 
 
 class DwellTimeService:
@@ -33,150 +31,201 @@ class DwellTimeService:
         self.bq_service = bq_service
         self.settings = settings
 
-    def _distance_meters(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        """Calculate approximate distance in meters between two GPS points"""
-        # At latitude ~55.5: 1 degree lat ≈ 111km, 1 degree lon ≈ 62km
-        lat_diff_m = (lat2 - lat1) * 111000
-        lon_diff_m = (lon2 - lon1) * 111000 * 0.566  # cos(55.5°) ≈ 0.566
-        return math.sqrt(lat_diff_m ** 2 + lon_diff_m ** 2)
-
     def _calculate_dwell_times(
         self,
-        tracks: list[dict],
+        tracks: dict[str, np.ndarray],
         spatial_threshold: float,
         min_dwell_time: int
-    ) -> list[dict]:
+    ) -> list[DwellEvent]:
         """
         Calculate dwell times from raw track data.
 
+        tracks holds one array per column, hash_id as visitor codes
+        (see BigQueryService.get_raw_track_arrays).
+
         Algorithm:
         1. Group tracks by hash_id (visitor)
         2. For each visitor, identify stationary periods
         3. A stationary period is consecutive points within spatial_threshold
+           of the centroid of the points before them
         4. Return dwell locations with duration
+
+        Points are held as arrays sorted by (visitor, timestamp). A period is always a
+        run of consecutive points, so every candidate centroid is a difference of prefix
+        sums and one vectorized distance test finds where a period ends. One-point
+        periods are found up front, so Python only loops over the periods that grow.
         """
-        # Group by visitor
-        visitor_tracks = defaultdict(list)
-        for track in tracks:
-            visitor_tracks[track["hash_id"]].append(track)
+        count = len(tracks["hash_id"])
+        if not count:
+            return []
+
+        # Group by visitor, then sort by timestamp
+        ts = tracks["timestamp"].astype(np.int64)
+        order = np.lexsort((ts, tracks["hash_id"]))
+        visitor = tracks["hash_id"][order]
+        lat = tracks["latitude"][order]
+        lon = tracks["longitude"][order]
+        ts = ts[order]
+        new_visitor = np.diff(visitor, prepend=-1) != 0
+        starts = np.flatnonzero(new_visitor)
+        ends = np.append(starts[1:], count)
+        # End of the visitor's points, for every point
+        visitor_end = np.repeat(ends, ends - starts)
+
+        # Positions in meters relative to the first point
+        north = (lat - lat[0]) * METERS_PER_DEG_LAT
+        east = (lon - lon[0]) * METERS_PER_DEG_LON
+        # Prefix sums: the centroid of points [i, j) is (cum[j] - cum[i]) / (j - i)
+        cum_north = np.concatenate(([0.0], np.cumsum(north)))
+        cum_east = np.concatenate(([0.0], np.cumsum(east)))
+        sizes = np.arange(count + 1, dtype=np.float64)
+        threshold_sq = spatial_threshold ** 2
+
+        # A period starting at point i grows only if point i+1 (same visitor) is within
+        # the threshold of point i. Other periods are a single point with zero duration,
+        # which only count when min_dwell_time is 0; visitors with one point never do.
+        grows = np.zeros(count, dtype=bool)
+        grows[:-1] = (np.diff(north) ** 2 + np.diff(east) ** 2 <= threshold_sq) & ~new_visitor[1:]
+        if min_dwell_time > 0:
+            period_starts = np.flatnonzero(grows)
+        else:
+            period_starts = np.flatnonzero(np.repeat(ends - starts, ends - starts) >= 2)
+
+        period_starts = period_starts.tolist()
+        lat0, lon0 = float(lat[0]), float(lon[0])
 
         dwell_events = []
 
-        for hash_id, points in visitor_tracks.items():
-            # Sort by timestamp
-            points = sorted(points, key=lambda x: x["timestamp"])
-
-            if len(points) < 2:
-                continue
-
-            # Find stationary periods
-            i = 0
-            while i < len(points):
-                start_point = points[i]
-                start_time = start_point["timestamp"]
-                centroid_lat = start_point["latitude"]
-                centroid_lon = start_point["longitude"]
-                count = 1
-
-                # Expand cluster while points are within threshold
+        # Find stationary periods [i, j), resuming at the first candidate start >= j
+        k = 0
+        while k < len(period_starts):
+            i = period_starts[k]
+            end = int(visitor_end[i])
+            if not grows[i]:
                 j = i + 1
-                while j < len(points):
-                    point = points[j]
-                    dist = self._distance_meters(
-                        centroid_lat, centroid_lon,
-                        point["latitude"], point["longitude"]
-                    )
-
-                    if dist <= spatial_threshold:
-                        # Update centroid
-                        centroid_lat = (centroid_lat * count + point["latitude"]) / (count + 1)
-                        centroid_lon = (centroid_lon * count + point["longitude"]) / (count + 1)
-                        count += 1
-                        j += 1
-                    else:
+            else:
+                # Test points i+2 .. stop-1 against the centroids of the points before
+                # each of them, widening the window until the period ends
+                window = 32
+                while True:
+                    stop = min(end, i + window)
+                    size = sizes[2:stop - i]
+                    d_north = north[i + 2:stop] - (cum_north[i + 2:stop] - cum_north[i]) / size
+                    d_east = east[i + 2:stop] - (cum_east[i + 2:stop] - cum_east[i]) / size
+                    outside = d_north * d_north + d_east * d_east > threshold_sq
+                    first = int(outside.argmax()) if len(outside) else 0
+                    if len(outside) and outside[first]:
+                        j = i + 2 + first
+                        break
+                    if stop == end:
+                        j = end
                         break
+                    window *= 4
 
-                end_time = points[j - 1]["timestamp"]
-                dwell_duration = end_time - start_time
+            start_time = int(ts[i])
+            end_time = int(ts[j - 1])
+            dwell_duration = end_time - start_time
 
-                # Cap dwell duration at 30 minutes (1800s) to filter out staff/outliers
-                MAX_DWELL_SECONDS = 1800
-                if dwell_duration >= min_dwell_time:
-                    dwell_events.append({
-                        "hash_id": hash_id,
-                        # x = longitude (horizontal), y = latitude (vertical)
-                        "x": centroid_lon,
-                        "y": centroid_lat,
-                        "duration": min(dwell_duration, MAX_DWELL_SECONDS),
-                        "start_time": start_time,
-                        "end_time": end_time
-                    })
+            if dwell_duration >= min_dwell_time:
+                dwell_events.append(DwellEvent(
+                    visitor=int(visitor[i]),
+                    # x = longitude (horizontal), y = latitude (vertical)
+                    x=lon0 + float(cum_east[j] - cum_east[i]) / (j - i) / METERS_PER_DEG_LON,
+                    y=lat0 + float(cum_north[j] - cum_north[i]) / (j - i) / METERS_PER_DEG_LAT,
+                    duration=min(dwell_duration, MAX_DWELL_SECONDS),
+                    start_time=start_time,
+                    end_time=end_time
+                ))
 
-                i = j
+            k = bisect_left(period_starts, j, k + 1)
 
         return dwell_events
 
     def _aggregate_dwell_to_grid(
         self,
-        dwell_events: list[dict],
-        grid_size: float
+        dwell_events: list[DwellEvent],
+        grid_size: float,
+        offset_x: float = 0.0,
+        offset_y: float = 0.0
     ) -> dict:
-        """Aggregate dwell events to grid cells"""
+        """Aggregate dwell events to grid cells (event positions shifted by the floor plan offset).
+
+        Events are bucketed with array arithmetic. Cells are returned as one array per
+        field (x, y, total_dwell_seconds, avg_dwell_seconds, visit_count,
+        unique_visitors), in the order they are first hit; routes turn them into rows.
+        """
         # Convert grid_size from meters to degrees
-        lat_grid = grid_size / 111000.0
-        lon_grid = grid_size / (111000.0 * 0.566)  # cos(55.5°)
-
-        grid_cells = defaultdict(lambda: {
-            "total_dwell": 0,
-            "visit_count": 0,
-            "visitors": set()
-        })
-
-        for event in dwell_events:
-            # Snap to grid: x=longitude, y=latitude
-            grid_x = math.floor(event["x"] / lon_grid) * lon_grid + (lon_grid / 2)
-            grid_y = math.floor(event["y"] / lat_grid) * lat_grid + (lat_grid / 2)
-            key = (grid_x, grid_y)
-
-            grid_cells[key]["total_dwell"] += event["duration"]
-            grid_cells[key]["visit_count"] += 1
-            grid_cells[key]["visitors"].add(event["hash_id"])
-
-        # Convert to list format
-        cells = []
-        min_x, max_x = float('inf'), float('-inf')
-        min_y, max_y = float('inf'), float('-inf')
-        total_dwell = 0
-
-        for (x, y), data in grid_cells.items():
-            avg_dwell = data["total_dwell"] / data["visit_count"] if data["visit_count"] > 0 else 0
-            cells.append({
-                "x": x,
-                "y": y,
-                "total_dwell_seconds": data["total_dwell"],
-                "avg_dwell_seconds": avg_dwell,
-                "visit_count": data["visit_count"],
-                "unique_visitors": len(data["visitors"])
-            })
-            min_x = min(min_x, x)
-            max_x = max(max_x, x)
-            min_y = min(min_y, y)
-            max_y = max(max_y, y)
-            total_dwell += data["total_dwell"]
-
-        total_visits = sum(c["visit_count"] for c in cells)
-        avg_dwell = total_dwell / total_visits if total_visits > 0 else 0
+        lat_grid = grid_size / METERS_PER_DEG_LAT
+        lon_grid = grid_size / METERS_PER_DEG_LON
+
+        if not dwell_events:
+            return {
+                "cells": {
+                    "x": np.empty(0), "y": np.empty(0),
+                    "total_dwell_seconds": np.empty(0, dtype=np.int64), "avg_dwell_seconds": np.empty(0),
+                    "visit_count": np.empty(0, dtype=np.int64), "unique_visitors": np.empty(0, dtype=np.int64)
+                },
+                "bounds": {"min_x": 0, "max_x": 0, "min_y": 0, "max_y": 0},
+                "total_dwell_time": 0,
+                "avg_dwell_time": 0
+            }
+
+        count = len(dwell_events)
+        x = np.fromiter((e.x for e in dwell_events), dtype=np.float64, count=count) + offset_x
+        y = np.fromiter((e.y for e in dwell_events), dtype=np.float64, count=count) + offset_y
+        durations = np.fromiter((e.duration for e in dwell_events), dtype=np.int64, count=count)
+
+        # Snap to grid: x=longitude, y=latitude. One integer key per (column, row) cell.
+        col = np.floor(x / lon_grid).astype(np.int64)
+        row = np.floor(y / lat_grid).astype(np.int64)
+        col -= col.min()
+        row -= row.min()
+        keys = col * (int(row.max()) + 1) + row
+
+        _, first, cell_of_event = np.unique(keys, return_index=True, return_inverse=True)
+        # np.unique sorts by key; renumber cells by first occurrence
+        order = np.argsort(first, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        cell_of_event = rank[cell_of_event.ravel()]
+        first = first[order]
+        n_cells = len(first)
+
+        totals = np.bincount(cell_of_event, weights=durations, minlength=n_cells).astype(np.int64)
+        visits = np.bincount(cell_of_event, minlength=n_cells)
+
+        # Unique visitors: distinct (cell, visitor) pairs counted per cell
+        visitor_of_event = np.fromiter((e.visitor for e in dwell_events), dtype=np.int64, count=count)
+        n_visitors = int(visitor_of_event.max()) + 1
+        pairs = np.unique(cell_of_event * n_visitors + visitor_of_event)
+        uniques = np.bincount(pairs // n_visitors, minlength=n_cells)
+
+        # Cell centres, computed from the first event in each cell
+        grid_x = np.floor(x[first] / lon_grid) * lon_grid + (lon_grid / 2)
+        grid_y = np.floor(y[first] / lat_grid) * lat_grid + (lat_grid / 2)
+
+        cells = {
+            "x": grid_x,
+            "y": grid_y,
+            "total_dwell_seconds": totals,
+            "avg_dwell_seconds": totals / visits,
+            "visit_count": visits,
+            "unique_visitors": uniques
+        }
+
+        total_dwell = int(totals.sum())
+        total_visits = int(visits.sum())
 
         return {
             "cells": cells,
             "bounds": {
-                "min_x": min_x if cells else 0,
-                "max_x": max_x if cells else 0,
-                "min_y": min_y if cells else 0,
-                "max_y": max_y if cells else 0
+                "min_x": float(grid_x.min()),
+                "max_x": float(grid_x.max()),
+                "min_y": float(grid_y.min()),
+                "max_y": float(grid_y.max())
             },
             "total_dwell_time": total_dwell,
-            "avg_dwell_time": avg_dwell
+            "avg_dwell_time": total_dwell / total_visits
         }
 
     async def get_dwell_heatmap(
@@ -195,37 +244,59 @@ class DwellTimeService:
         grid_size = grid_size or self.settings.heatmap_grid_size
         spatial_threshold = self.settings.dwell_spatial_threshold
 
-        # Get raw tracks (returns tuple of tracks, total_count)
-        tracks, _ = await self.bq_service.get_raw_tracks(
-            store_id=store_id,
-            floor=floor,
-            start_date=start_date,
-            end_date=end_date,
-            start_hour=start_hour,
-            end_hour=end_hour
-        )
-
-        # Calculate dwell times
-        dwell_events = self._calculate_dwell_times(
-            tracks=tracks,
-            spatial_threshold=spatial_threshold,
-            min_dwell_time=min_dwell_seconds
-        )
+        if self.settings.dwell_in_bigquery:
+            # Stationary periods found in BigQuery over all points (see get_dwell_events)
+            events = await self.bq_service.get_dwell_events(
+                store_id=store_id,
+                floor=floor,
+                start_date=start_date,
+                end_date=end_date,
+                start_hour=start_hour,
+                end_hour=end_hour,
+                spatial_threshold=spatial_threshold,
+                min_dwell_seconds=min_dwell_seconds
+            )
+            dwell_events = [
+                DwellEvent(
+                    visitor=visitor,
+                    x=x,
+                    y=y,
+                    duration=min(end_time - start_time, MAX_DWELL_SECONDS),
+                    start_time=start_time,
+                    end_time=end_time
+                )
+                for visitor, x, y, start_time, end_time in zip(
+                    *(events[name].tolist() for name in ("hash_id", "x", "y", "start_time", "end_time"))
+                )
+            ]
+        else:
+            # Get raw tracks as column arrays (returns tuple of arrays, total_count)
+            tracks, _ = await self.bq_service.get_raw_track_arrays(
+                store_id=store_id,
+                floor=floor,
+                start_date=start_date,
+                end_date=end_date,
+                start_hour=start_hour,
+                end_hour=end_hour,
+                columns=("hash_id", "latitude", "longitude", "timestamp")
+            )
+
+            # Calculate dwell times
+            dwell_events = self._calculate_dwell_times(
+                tracks=tracks,
+                spatial_threshold=spatial_threshold,
+                min_dwell_time=min_dwell_seconds
+            )
 
         # Filter by max dwell time if specified
         if max_dwell_seconds:
-            dwell_events = [e for e in dwell_events if e["duration"] <= max_dwell_seconds]
+            dwell_events = [e for e in dwell_events if e.duration <= max_dwell_seconds]
 
         # Get coordinate offset to align with floor plan
         offset_x, offset_y = await get_coordinate_offset(store_id, floor)
 
-        # Apply offset to dwell events before aggregation
-        for event in dwell_events:
-            event["x"] += offset_x
-            event["y"] += offset_y
-
-        # Aggregate to grid
-        result = self._aggregate_dwell_to_grid(dwell_events, grid_size)
+        # Aggregate to grid (the offset is applied to the events first)
+        result = self._aggregate_dwell_to_grid(dwell_events, grid_size, offset_x, offset_y)
         result["grid_size"] = grid_size
 
         return result
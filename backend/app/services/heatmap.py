@@ -1,5 +1,6 @@
 from datetime import date
 from typing import Optional
+import numpy as np
 
 from app.services.bigquery import BigQueryService
 from app.config import Settings
@@ -18,7 +19,8 @@ class HeatmapService:
         end_date: date,
         start_hour: int = 0,
         end_hour: int = 23,
-        grid_size: Optional[float] = None
+        grid_size: Optional[float] = None,
+        layout: str = "rows"
     ) -> dict:
         """Get heatmap data for visualization"""
         grid_size = grid_size or self.settings.heatmap_grid_size
@@ -30,27 +32,37 @@ class HeatmapService:
             end_date=end_date,
             start_hour=start_hour,
             end_hour=end_hour,
-            grid_size=grid_size
+            grid_size=grid_size,
+            layout=layout
         )
 
         return data
 
-    def normalize_heatmap(self, cells: list[dict], max_value: Optional[int] = None) -> list[dict]:
-        """Normalize heatmap values to 0-1 range for visualization"""
-        if not cells:
-            return []
+    def normalize_heatmap(
+        self,
+        cells: list[dict] | dict[str, np.ndarray],
+        max_value: Optional[int] = None
+    ) -> list[dict] | dict[str, np.ndarray]:
+        """Normalize heatmap values to 0-1 range for visualization.
+
+        Accepts either cell layout of get_heatmap; columns get an intensity array.
+        """
+        columns = isinstance(cells, dict)
+        if columns:
+            counts = np.asarray(cells["track_count"], dtype=np.float64)
+        else:
+            counts = np.fromiter((c["track_count"] for c in cells), dtype=np.float64, count=len(cells))
+
+        if not len(counts):
+            return cells if columns else []
 
         if max_value is None:
-            max_value = max(c["track_count"] for c in cells)
+            max_value = counts.max()
 
         if max_value == 0:
             return cells
 
-        normalized = []
-        for cell in cells:
-            normalized.append({
-                **cell,
-                "intensity": cell["track_count"] / max_value
-            })
-
-        return normalized
+        intensities = counts / max_value
+        if columns:
+            return {**cells, "intensity": intensities}
+        return [{**cell, "intensity": intensity} for cell, intensity in zip(cells, intensities.tolist())]
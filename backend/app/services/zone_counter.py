@@ -1,30 +1,13 @@
 from datetime import date
 from typing import Optional
-import aiosqlite
-import os
+import asyncio
+import numpy as np
 
 from app.services.bigquery import BigQueryService
 from app.services.dwell_time import DwellTimeService
 from app.config import Settings
-
-# Database path for floor plan offsets
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "tracking.db")
-
-
-async def get_coordinate_offset(store_id: int, floor: int) -> tuple[float, float]:
-    """Get coordinate offset for a floor plan."""
-    try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "SELECT offset_x, offset_y FROM floorplans WHERE store_id = ? AND floor = ?",
-                (store_id, floor)
-            )
-            row = await cursor.fetchone()
-            if row and row[0] is not None and row[1] is not None:
-                return row[0], row[1]  # offset_x (longitude), offset_y (latitude)
-    except Exception:
-        pass
-    return 0.0, 0.0
+from app.models.database import get_coordinate_offset
+from app.utils.spatial import points_in_rectangles
 
 
 class ZoneCounterService:
@@ -49,7 +32,7 @@ class ZoneCounterService:
         offset_x, offset_y = await get_coordinate_offset(store_id, floor)
 
         # Get basic stats from BigQuery (pass offset to subtract from zone coords)
-        stats = await self.bq_service.get_zone_stats(
+        stats_query = self.bq_service.get_zone_stats(
             store_id=store_id,
             floor=floor,
             zones=zones,
@@ -61,10 +44,15 @@ class ZoneCounterService:
             offset_y=offset_y
         )
 
-        if include_dwell:
-            # Calculate dwell time for each zone
-            # This is more expensive, so it's optional
-            dwell_data = await self.dwell_service.get_dwell_heatmap(
+        if not include_dwell:
+            return await stats_query
+
+        # Calculate dwell time for each zone
+        # This is more expensive, so it's optional. It does not depend on the
+        # zone counts, so both BigQuery reads run concurrently.
+        stats, dwell_data = await asyncio.gather(
+            stats_query,
+            self.dwell_service.get_dwell_heatmap(
                 store_id=store_id,
                 floor=floor,
                 start_date=start_date,
@@ -72,28 +60,31 @@ class ZoneCounterService:
                 start_hour=start_hour,
                 end_hour=end_hour
             )
+        )
+
+        # Calculate average dwell per zone: one (cells x zones) containment matrix
+        # instead of scanning every cell for every zone.
+        # Note: dwell cells have offset applied, so zone coords need offset too
+        # (the zone counts are shared with the query cache, so they are copied first)
+        stats = [dict(stat) for stat in stats]
+        cells = dwell_data["cells"]
+        zones_by_id = {z["id"]: z for z in zones}
+        matched = [(stat, zones_by_id[stat["zone_id"]]) for stat in stats if stat["zone_id"] in zones_by_id]
+        if matched:
+            cell_x, cell_y = cells["x"], cells["y"]
+            cell_dwell, cell_visits = cells["total_dwell_seconds"], cells["visit_count"]
+
+            # Apply offset to zone coordinates to match dwell cell coordinates
+            zone_x1 = np.array([z["x1"] for _, z in matched], dtype=np.float64) + offset_x
+            zone_x2 = np.array([z["x2"] for _, z in matched], dtype=np.float64) + offset_x
+            zone_y1 = np.array([z["y1"] for _, z in matched], dtype=np.float64) + offset_y
+            zone_y2 = np.array([z["y2"] for _, z in matched], dtype=np.float64) + offset_y
 
-            # Calculate average dwell per zone
-            # Note: dwell cells have offset applied, so zone coords need offset too
-            for stat in stats:
-                zone = next((z for z in zones if z["id"] == stat["zone_id"]), None)
-                if zone:
-                    # Apply offset to zone coordinates to match dwell cell coordinates
-                    zone_x1 = zone["x1"] + offset_x
-                    zone_x2 = zone["x2"] + offset_x
-                    zone_y1 = zone["y1"] + offset_y
-                    zone_y2 = zone["y2"] + offset_y
+            inside = points_in_rectangles(cell_x, cell_y, zone_x1, zone_y1, zone_x2, zone_y2)
+            zone_dwell = cell_dwell @ inside
+            zone_visits = cell_visits @ inside
 
-                    zone_dwell = [
-                        c for c in dwell_data["cells"]
-                        if (min(zone_x1, zone_x2) <= c["x"] <= max(zone_x1, zone_x2) and
-                            min(zone_y1, zone_y2) <= c["y"] <= max(zone_y1, zone_y2))
-                    ]
-                    if zone_dwell:
-                        total_dwell = sum(c["total_dwell_seconds"] for c in zone_dwell)
-                        total_visits = sum(c["visit_count"] for c in zone_dwell)
-                        stat["avg_dwell_seconds"] = total_dwell / total_visits if total_visits > 0 else 0
-                    else:
-                        stat["avg_dwell_seconds"] = 0
+            for (stat, _), total_dwell, total_visits in zip(matched, zone_dwell.tolist(), zone_visits.tolist()):
+                stat["avg_dwell_seconds"] = total_dwell / total_visits if total_visits > 0 else 0.0
 
         return stats
@@ -0,0 +1,131 @@
+import asyncio
+import functools
+import inspect
+import time
+from datetime import date
+from typing import Any, Callable, Hashable, Optional
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Small in-process cache whose entries expire after `ttl` seconds.
+
+    Reads and writes never await, so it is safe to share between coroutines
+    on the same event loop without a lock.
+
+    With `maxbytes`, values must be bytes and the cache is also bounded by their
+    total length; a value larger than `maxbytes` is not cached.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024, maxbytes: Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self._data: dict[Hashable, tuple[float, Any]] = {}
+        self._bytes = 0
+
+    def _size(self, value: Any) -> int:
+        return len(value) if self.maxbytes is not None else 0
+
+    def _pop(self, key: Hashable) -> None:
+        entry = self._data.pop(key, _MISSING)
+        if entry is not _MISSING:
+            self._bytes -= self._size(entry[1])
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._pop(key)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._pop(key)
+        size = self._size(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        while self._data and (
+            len(self._data) >= self.maxsize
+            or (self.maxbytes is not None and self._bytes + size > self.maxbytes)
+        ):
+            # Evict the oldest insertion
+            self._pop(next(iter(self._data)))
+        self._data[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self._bytes += size
+
+    def invalidate(self, key: Hashable) -> None:
+        self._pop(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._bytes = 0
+
+
+# Encoded JSON bodies of the BigQuery-backed heatmap and dwell endpoints. Payloads can
+# hold hundreds of thousands of points, so the cache is bounded by their total size.
+response_cache = TTLCache(ttl=300, maxsize=64, maxbytes=256 * 1024 * 1024)
+
+# Date ranges that ended before today no longer change
+HISTORIC_RESPONSE_TTL = 86400
+
+
+def response_ttl(end_date: date) -> float:
+    return HISTORIC_RESPONSE_TTL if end_date < date.today() else response_cache.ttl
+
+
+# Results of the small aggregate BigQuery reads (floor totals, zone stats, store lists)
+query_cache = TTLCache(ttl=120, maxsize=512)
+_inflight_queries: dict[Hashable, asyncio.Task] = {}
+
+
+def _freeze(value: Any) -> Hashable:
+    """Turn (nested) argument lists and dicts into hashable tuples."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def cached_query(cache_if: Callable[[Any], bool] = lambda result: True):
+    """Cache an async BigQueryService read in query_cache, keyed by its arguments.
+
+    Concurrent calls with the same arguments share one query. Results are shared
+    between callers, so they must not be mutated. Reads with an end_date in the
+    past are kept as long as historic responses.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            arguments = {k: v for k, v in bound.arguments.items() if k != "self"}
+            key = (method.__qualname__, self.table_id, _freeze(arguments))
+
+            cached = query_cache.get(key, _MISSING)
+            if cached is not _MISSING:
+                return cached
+
+            task = _inflight_queries.get(key)
+            if task is None:
+                task = asyncio.ensure_future(method(self, *args, **kwargs))
+                _inflight_queries[key] = task
+                task.add_done_callback(lambda _: _inflight_queries.pop(key, None))
+            result = await asyncio.shield(task)
+
+            if cache_if(result):
+                end_date = arguments.get("end_date")
+                historic = isinstance(end_date, date) and end_date < date.today()
+                query_cache.set(key, result, ttl=HISTORIC_RESPONSE_TTL if historic else None)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,5 +1,6 @@
 import math
 from typing import Tuple
+import numpy as np
 
 
 def point_in_rectangle(
@@ -13,9 +14,33 @@ def point_in_rectangle(
     return min_x <= px <= max_x and min_y <= py <= max_y
 
 
+def points_in_rectangles(
+    px: np.ndarray, py: np.ndarray,
+    x1: np.ndarray, y1: np.ndarray,
+    x2: np.ndarray, y2: np.ndarray
+) -> np.ndarray:
+    """Batch point_in_rectangle: a (points x rectangles) mask of which point lies in which rectangle.
+
+    Rectangle corners may be given in either order; edges count as inside.
+    """
+    min_x, max_x = np.minimum(x1, x2), np.maximum(x1, x2)
+    min_y, max_y = np.minimum(y1, y2), np.maximum(y1, y2)
+    # Branchless comparisons ANDed into one mask in place
+    inside = px[:, None] >= min_x
+    inside &= px[:, None] <= max_x
+    inside &= py[:, None] >= min_y
+    inside &= py[:, None] <= max_y
+    return inside
+
+
 def distance(x1: float, y1: float, x2: float, y2: float) -> float:
     """Calculate Euclidean distance between two points"""
-    return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    return math.hypot(x2 - x1, y2 - y1)
+
+
+def distances(x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """Batch distance: element-wise Euclidean distances (arrays broadcast against each other)."""
+    return np.hypot(x2 - x1, y2 - y1)
 
 
 def data_to_image_coords(
@@ -46,6 +71,28 @@ def data_to_image_coords(
     return pixel_x, pixel_y
 
 
+def data_to_image_coords_batch(
+    data_x: np.ndarray,
+    data_y: np.ndarray,
+    data_min_x: float,
+    data_max_x: float,
+    data_min_y: float,
+    data_max_y: float,
+    image_width: int,
+    image_height: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Array version of data_to_image_coords, returning int32 pixel arrays."""
+    # Degenerate bounds normalize to 0, as in the scalar version
+    range_x = np.where(data_max_x != data_min_x, data_max_x - data_min_x, 1.0)
+    range_y = np.where(data_max_y != data_min_y, data_max_y - data_min_y, 1.0)
+    norm_x = np.where(data_max_x != data_min_x, (data_x - data_min_x) / range_x, 0.0)
+    norm_y = np.where(data_max_y != data_min_y, (data_y - data_min_y) / range_y, 0.0)
+
+    pixel_x = (norm_x * image_width).astype(np.int32)
+    pixel_y = ((1 - norm_y) * image_height).astype(np.int32)
+    return pixel_x, pixel_y
+
+
 def image_to_data_coords(
     pixel_x: int,
     pixel_y: int,
@@ -70,6 +117,25 @@ def image_to_data_coords(
     return data_x, data_y
 
 
+def image_to_data_coords_batch(
+    pixel_x: np.ndarray,
+    pixel_y: np.ndarray,
+    data_min_x: float,
+    data_max_x: float,
+    data_min_y: float,
+    data_max_y: float,
+    image_width: int,
+    image_height: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Array version of image_to_data_coords, returning float64 arrays."""
+    norm_x = np.where(image_width > 0, pixel_x / max(image_width, 1), 0.0)
+    norm_y = np.where(image_height > 0, 1 - pixel_y / max(image_height, 1), 0.0)  # Flip y
+
+    data_x = data_min_x + norm_x * (data_max_x - data_min_x)
+    data_y = data_min_y + norm_y * (data_max_y - data_min_y)
+    return data_x, data_y
+
+
 def snap_to_grid(value: float, grid_size: float) -> float:
     """Snap a value to the nearest grid cell center"""
     return math.floor(value / grid_size) * grid_size + (grid_size / 2)
@@ -0,0 +1,196 @@
+"""Compare the array-based dwell pipeline against the original per-point loops.
+
+The reference functions below are the dwell period search and grid aggregation as
+they were before they were rewritten with NumPy; the service must produce the same
+events and cells.
+"""
+import math
+import random
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from app.services.dwell_time import (
+    METERS_PER_DEG_LAT,
+    METERS_PER_DEG_LON,
+    MAX_DWELL_SECONDS,
+    DwellEvent,
+    DwellTimeService,
+)
+
+
+def reference_dwell_times(tracks: list[dict], spatial_threshold: float, min_dwell_time: int) -> list[dict]:
+    """Per-visitor loop: grow a period while the next point is within the threshold of its centroid."""
+    visitor_tracks = defaultdict(list)
+    for track in tracks:
+        visitor_tracks[track["hash_id"]].append(track)
+
+    dwell_events = []
+    for hash_id, points in visitor_tracks.items():
+        points = sorted(points, key=lambda x: x["timestamp"])
+        if len(points) < 2:
+            continue
+
+        i = 0
+        while i < len(points):
+            start_time = points[i]["timestamp"]
+            centroid_lat = points[i]["latitude"]
+            centroid_lon = points[i]["longitude"]
+            count = 1
+
+            j = i + 1
+            while j < len(points):
+                point = points[j]
+                lat_diff_m = (point["latitude"] - centroid_lat) * METERS_PER_DEG_LAT
+                lon_diff_m = (point["longitude"] - centroid_lon) * METERS_PER_DEG_LON
+                if math.sqrt(lat_diff_m ** 2 + lon_diff_m ** 2) > spatial_threshold:
+                    break
+                centroid_lat = (centroid_lat * count + point["latitude"]) / (count + 1)
+                centroid_lon = (centroid_lon * count + point["longitude"]) / (count + 1)
+                count += 1
+                j += 1
+
+            end_time = points[j - 1]["timestamp"]
+            dwell_duration = end_time - start_time
+            if dwell_duration >= min_dwell_time:
+                dwell_events.append({
+                    "hash_id": hash_id,
+                    "x": centroid_lon,
+                    "y": centroid_lat,
+                    "duration": min(dwell_duration, MAX_DWELL_SECONDS),
+                    "start_time": start_time,
+                    "end_time": end_time
+                })
+            i = j
+
+    return dwell_events
+
+
+def reference_grid(dwell_events: list[dict], grid_size: float) -> list[dict]:
+    """Dict-of-cells aggregation, cells in the order they are first hit."""
+    lat_grid = grid_size / METERS_PER_DEG_LAT
+    lon_grid = grid_size / METERS_PER_DEG_LON
+
+    grid_cells = defaultdict(lambda: {"total_dwell": 0, "visit_count": 0, "visitors": set()})
+    for event in dwell_events:
+        grid_x = math.floor(event["x"] / lon_grid) * lon_grid + (lon_grid / 2)
+        grid_y = math.floor(event["y"] / lat_grid) * lat_grid + (lat_grid / 2)
+        cell = grid_cells[(grid_x, grid_y)]
+        cell["total_dwell"] += event["duration"]
+        cell["visit_count"] += 1
+        cell["visitors"].add(event["hash_id"])
+
+    return [
+        {
+            "x": x,
+            "y": y,
+            "total_dwell_seconds": data["total_dwell"],
+            "avg_dwell_seconds": data["total_dwell"] / data["visit_count"],
+            "visit_count": data["visit_count"],
+            "unique_visitors": len(data["visitors"])
+        }
+        for (x, y), data in grid_cells.items()
+    ]
+
+
+def make_tracks(seed: int) -> list[dict]:
+    """Random walks mixing stationary bursts and moves near the 2 m threshold.
+
+    Includes visitors with a single point and repeated timestamps, and rows are
+    shuffled across visitors as they would arrive from BigQuery.
+    """
+    rng = random.Random(seed)
+    tracks = []
+    for v in range(60):
+        hash_id = f"visitor-{v:03d}"
+        n_points = 1 if v % 10 == 0 else rng.randint(2, 80)
+        north, east = rng.uniform(0, 200), rng.uniform(0, 200)
+        ts = 1_700_000_000 + rng.randint(0, 3600)
+        for _ in range(n_points):
+            step = rng.choice((0.2, 0.8, 1.5, 2.5, 6.0))
+            angle = rng.uniform(0, 2 * math.pi)
+            north += step * math.sin(angle)
+            east += step * math.cos(angle)
+            # Repeated timestamps are common in the raw data
+            ts += rng.choice((0, 0, 5, 10, 30, 120, 900))
+            tracks.append({
+                "hash_id": hash_id,
+                "latitude": 55.6 + north / METERS_PER_DEG_LAT,
+                "longitude": 13.0 + east / METERS_PER_DEG_LON,
+                "timestamp": ts
+            })
+    rng.shuffle(tracks)
+    return tracks
+
+
+def to_arrays(tracks: list[dict]) -> tuple[dict[str, np.ndarray], list[str]]:
+    """Column arrays as BigQueryService.get_raw_track_arrays returns them (hash_id as codes)."""
+    codes: dict[str, int] = {}
+    arrays = {
+        "hash_id": np.array([codes.setdefault(t["hash_id"], len(codes)) for t in tracks], dtype=np.int64),
+        "latitude": np.array([t["latitude"] for t in tracks]),
+        "longitude": np.array([t["longitude"] for t in tracks]),
+        "timestamp": np.array([t["timestamp"] for t in tracks], dtype=np.float64)
+    }
+    return arrays, list(codes)
+
+
+@pytest.fixture
+def service() -> DwellTimeService:
+    return DwellTimeService(bq_service=None, settings=None)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("min_dwell", [0, 1, 30])
+def test_dwell_times_match_reference(service, seed, min_dwell):
+    tracks = make_tracks(seed)
+    arrays, hash_ids = to_arrays(tracks)
+
+    expected = reference_dwell_times(tracks, spatial_threshold=2.0, min_dwell_time=min_dwell)
+    events = service._calculate_dwell_times(arrays, spatial_threshold=2.0, min_dwell_time=min_dwell)
+
+    assert len(events) == len(expected)
+    for event, ref in zip(events, expected):
+        assert hash_ids[event.visitor] == ref["hash_id"]
+        assert (event.start_time, event.end_time, event.duration) == (
+            ref["start_time"], ref["end_time"], ref["duration"]
+        )
+        # Centroids come from prefix sums rather than a running mean
+        assert event.x == pytest.approx(ref["x"], rel=0, abs=1e-9)
+        assert event.y == pytest.approx(ref["y"], rel=0, abs=1e-9)
+
+
+def test_dwell_times_empty(service):
+    arrays, _ = to_arrays([])
+    assert service._calculate_dwell_times(arrays, spatial_threshold=2.0, min_dwell_time=30) == []
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("grid_size", [0.5, 1.0, 5.0])
+def test_grid_matches_reference(service, seed, grid_size):
+    tracks = make_tracks(seed)
+    reference_events = reference_dwell_times(tracks, spatial_threshold=2.0, min_dwell_time=0)
+    offset_x, offset_y = 0.00012, -0.00034
+
+    # Both aggregations get the same events; the reference applies the offset up front
+    hash_ids = list(dict.fromkeys(e["hash_id"] for e in reference_events))
+    events = [
+        DwellEvent(hash_ids.index(e["hash_id"]), e["x"], e["y"], e["duration"], e["start_time"], e["end_time"])
+        for e in reference_events
+    ]
+    shifted = [{**e, "x": e["x"] + offset_x, "y": e["y"] + offset_y} for e in reference_events]
+
+    expected = reference_grid(shifted, grid_size)
+    result = service._aggregate_dwell_to_grid(events, grid_size, offset_x, offset_y)
+    cells = result["cells"]
+    rows = [dict(zip(cells, values)) for values in zip(*(cells[field].tolist() for field in cells))]
+
+    assert rows == expected
+    assert result["total_dwell_time"] == sum(c["total_dwell_seconds"] for c in expected)
+
+
+def test_grid_empty(service):
+    result = service._aggregate_dwell_to_grid([], 1.0)
+    assert len(result["cells"]["x"]) == 0
+    assert result["total_dwell_time"] == 0